@@ -0,0 +1,48 @@
+"""Per invocation cost of getting the dynamodb resource and table handles,
+   creating them every time as the handlers used to, against reusing them
+   from get_dynamo and get_table. No requests are sent to AWS.
+
+   python benchmarks/bench_connection.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'farkle'))
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+
+# pylint: disable=wrong-import-position
+import boto3
+import storage
+
+# tables a /roll touches
+TABLES = ['sessions', 'players', 'games']
+
+
+def every_time():
+    """build the resource and tables for each invocation
+    """
+    db_conn = boto3.resource('dynamodb', region_name='us-west-1')
+    for table_name in TABLES:
+        db_conn.Table(table_name)
+
+
+def reused():
+    """reuse the resource and tables of the container
+    """
+    db_conn = storage.get_dynamo()
+    for table_name in TABLES:
+        storage.get_table(db_conn, table_name)
+
+
+def main():
+    """run the benchmark
+    """
+    for name, func, number in (('every invocation', every_time, 20), ('reused', reused, 20000)):
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        print("%-18s %10.1f us per invocation" % (name, best / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Compare the old json round trip in load_gamestate with from_item, on a
+   LONG session with 10 completed turns as boto3 returns it.
+
+   python benchmarks/bench_load_gamestate.py
+"""
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'farkle'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tools'))
+
+# pylint: disable=wrong-import-position
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+import app
+import simulate
+
+
+def long_session_item():
+    """play a LONG game of 10 turns and return its session the way boto3 reads it
+    """
+    random.seed(1)
+    game_state = simulate.FixedScrewsGame(1.0)
+    game_state.balance = 10 ** 9
+    game_state.gameMode = "LONG"
+    game_state.start_turn(500)
+    strategy = simulate.ThresholdStrategy()
+    result = simulate.SimResult("LONG")
+    for turn in range(10):
+        simulate.play_turn(game_state, strategy, result)
+        if turn < 9:
+            game_state.start_turn(500)
+    assert len(game_state.turns) == 10
+    serializer = TypeSerializer()
+    deserializer = TypeDeserializer()
+    return {key: deserializer.deserialize(serializer.serialize(value))
+            for key, value in game_state.get_save_dict().items()}
+
+
+def json_round_trip(item):
+    """the conversion load_gamestate used before from_item
+    """
+    return json.loads(json.dumps(item, cls=app.GameEncoder), object_hook=app.object_decoder)
+
+
+def main():
+    """run the benchmark
+    """
+    item = long_session_item()
+    number = 2000
+    for name, func in (('json round trip', json_round_trip), ('from_item', app.from_item)):
+        best = min(timeit.repeat(lambda: func(item), number=number, repeat=5))
+        print("%-16s %8.1f us per session" % (name, best / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Compare encoding the whole game state with GameEncoder, as format_response
+   did before, with the compiled projection it uses now and with the delta
+   after a roll, on a LONG game with 9 completed turns.
+
+   python benchmarks/bench_response.py
+"""
+import copy
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'farkle'))
+
+# pylint: disable=wrong-import-position
+import app
+import responses
+from bench_suite import long_game
+
+
+def game_encoder(game_state):
+    """the body format_response returned before the projection
+    """
+    return json.dumps(game_state, cls=app.GameEncoder)
+
+
+def projection(game_state):
+    """the body format_response returns now
+    """
+    return app.format_response(game_state)['body']
+
+
+def main():
+    """run the benchmark
+    """
+    game_state = long_game(9)
+    # what a player and the game left behind during the turn
+    game_state.player_adjustments.update({'num_credits': -500, 'farkle.amount_bet': 500})
+    game_state.game_adjust.update({'jackpot': 50})
+    slim = json.loads(projection(game_state))
+    assert set(slim) == set(responses.GAME_FIELDS)
+    assert slim['turns'] == json.loads(game_encoder(game_state))['turns']
+
+    rolled = copy.deepcopy(game_state)
+    responses.mark_base(rolled)
+    rolled.roll(None, False)
+    rolled.version += 1
+
+    number = 2000
+    for name, func, state in (('GameEncoder', game_encoder, game_state),
+                              ('projection', projection, game_state),
+                              ('delta', projection, rolled)):
+        best = min(timeit.repeat(lambda: func(state), number=number, repeat=5))
+        print("%-12s %8.1f us per response %6d bytes" % (name, best / number * 1e6,
+                                                         len(func(state))))
+
+
+if __name__ == '__main__':
+    main()
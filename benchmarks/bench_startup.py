@@ -0,0 +1,126 @@
+"""Cold start benchmark for the lambda entry point. Each run starts a fresh
+   python with -X importtime, imports app and calls shared_handler for one
+   command, then reports the time spent importing each module.
+
+   The child uses the memory storage, seeded before the handler is called
+   with a player and a started game made in this process, so every command
+   takes its successful path and the run needs no network.
+
+   python benchmarks/bench_startup.py --runs 5
+"""
+import argparse
+import collections
+import json
+import os
+import subprocess
+import sys
+
+FARKLE = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'farkle'))
+
+# command -> request body, with the ids of the seeded player and session
+COMMANDS = {
+    'unknown': '{}',
+    'login': '{"username": "bench", "password": "bench", "displayname": "Bench"}',
+    'start': '{"player_id": "%(player_id)s", "bet": 500}',
+    'roll': '{"session": "%(session)s", "player_id": "%(player_id)s"}',
+}
+
+CHILD = '''
+import time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+db_conn = app.get_storage()
+for table_name, item in %r:
+    db_conn.put(table_name, item)
+seeded = time.perf_counter()
+response = app.shared_handler({'pathParameters': {'command': %r}, 'body': %r}, None)
+handled = time.perf_counter()
+print('TIMING %%d %%f %%f' %% (response['statusCode'], imported - start, handled - seeded))
+'''
+
+
+def seed():
+    """make a player and a started game in memory storage. Returns the items
+       to put in the child and the values for the request bodies
+    """
+    sys.path.insert(0, FARKLE)
+    # pylint: disable=import-outside-toplevel
+    import app
+    import storage
+
+    db_conn = storage.MemoryStorage()
+    app.set_storage(db_conn)
+    try:
+        login = json.loads(app.shared_handler({
+            'pathParameters': {'command': 'login'},
+            'body': COMMANDS['login']
+        }, None)['body'])
+        game = json.loads(app.shared_handler({
+            'pathParameters': {'command': 'start'},
+            'body': json.dumps({'player_id': login['player_id'], 'bet': 500})
+        }, None)['body'])
+    finally:
+        app.set_storage(None)
+    items = [
+        ('usernames', db_conn.get('usernames', {'username': 'bench'})),
+        ('players', db_conn.get('players', {'player_id': login['player_id']})),
+        ('sessions', db_conn.get('sessions', {'uniqID': game['uniqID']})),
+    ]
+    return items, {'player_id': login['player_id'], 'session': game['uniqID']}
+
+
+def run_once(command, items, ids):
+    """run one cold start. Returns (import seconds, handler seconds,
+       {module: cumulative import microseconds} for the top level imports)
+    """
+    env = dict(os.environ, FARKLE_STORAGE='memory')
+    code = CHILD % (items, command, COMMANDS.get(command, '{}') % ids)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=FARKLE,
+                            env=env, capture_output=True, text=True, check=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # only count modules imported directly by the code, not by other modules
+        if name.startswith('  '):
+            continue
+        modules[name.strip()] = int(cumulative)
+    timing = [line for line in result.stdout.splitlines() if line.startswith('TIMING')][0]
+    status, import_seconds, handler_seconds = timing.split()[1:]
+    # unknown is the only command that is meant to fail
+    if command in COMMANDS and command != 'unknown' and status != '200':
+        raise RuntimeError("%s returned %s" % (command, status))
+    return float(import_seconds), float(handler_seconds), modules
+
+
+def main():
+    """run the benchmark
+    """
+    parser = argparse.ArgumentParser(description="measure cold start import time")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('command', nargs='*', default=list(COMMANDS))
+    args = parser.parse_args()
+
+    items, ids = seed()
+    for command in args.command:
+        imports = []
+        handlers = []
+        modules = collections.defaultdict(list)
+        for _ in range(args.runs):
+            import_seconds, handler_seconds, run_modules = run_once(command, items, ids)
+            imports.append(import_seconds)
+            handlers.append(handler_seconds)
+            for name, micros in run_modules.items():
+                modules[name].append(micros)
+        print("%s: import app %.1f ms, first shared_handler %.1f ms (best of %d)" % (
+            command, min(imports) * 1000, min(handlers) * 1000, args.runs))
+        ranked = sorted(modules.items(), key=lambda item: -min(item[1]))
+        for name, micros in ranked[:args.top]:
+            print("  %8.1f ms  %s" % (min(micros) / 1000, name))
+
+
+if __name__ == '__main__':
+    main()
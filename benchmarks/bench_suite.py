@@ -0,0 +1,259 @@
+"""Micro-benchmarks of the hot paths of a request, checked against the
+   baselines in baseline.json. Exits with an error if any of them got slower
+   than its baseline by more than the tolerance.
+
+   Times are measured relative to a fixed pure python loop run just before
+   each case, so the baselines carry over between machines. Update them after a change
+   that is meant to change the speed:
+
+   python benchmarks/bench_suite.py
+   python benchmarks/bench_suite.py --update
+"""
+import argparse
+import copy
+import gc
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'farkle'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tools'))
+
+# pylint: disable=wrong-import-position
+import app
+import gamestate
+import scoredice
+import simulate
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+# percent slower than the baseline that counts as a regression. Runs on a busy
+# machine vary by about 40%
+TOLERANCE = 50.0
+# rounds over all the cases. The median cost of each case is saved as its
+# baseline, and the best is compared with it, so a case only fails if none of
+# its rounds comes close to a typical one
+RUNS = 5
+# a case that still looks slower is measured again this many rounds before it
+# fails, since a busy machine can slow down every run of one round
+RETRIES = 3
+
+
+def calibration(count):
+    """fixed work that only depends on the speed of the machine and python
+    """
+    def run():
+        total = 0
+        values = {}
+        for idx in range(count):
+            values[idx & 63] = total
+            total += idx * 3 % 7
+        return total
+    return run
+
+
+def long_game(turns):
+    """a LONG game with turns completed and the next turn started"""
+    random.seed(1)
+    game_state = simulate.FixedScrewsGame(1.0)
+    game_state.balance = 10 ** 9
+    game_state.gameMode = "LONG"
+    game_state.start_turn(500)
+    strategy = simulate.ThresholdStrategy()
+    result = simulate.SimResult("LONG")
+    for _ in range(turns):
+        simulate.play_turn(game_state, strategy, result)
+        game_state.start_turn(500)
+    game_state.player_adjustments.clear()
+    game_state.game_adjust.clear()
+    return game_state
+
+
+def score_dice(num_dice):
+    """ScoreDice on rolls of num_dice dice"""
+    def prepare(count):
+        rng = random.Random(num_dice)
+        rolls = [[rng.randint(1, 6) for _ in range(num_dice)] for _ in range(count)]
+
+        def run():
+            for rolled in rolls:
+                scoredice.ScoreDice(rolled)
+        return run
+    return prepare
+
+
+def game_roll(count):
+    """GameState.roll of 6 dice in a NORMAL game"""
+    game_state = gamestate.GameState()
+    game_state.balance = 10 ** 9
+    game_state.start_turn(500)
+    turn = game_state.turn
+
+    def run():
+        for _ in range(count):
+            # roll the first dice of the turn again
+            turn.rolled = False
+            turn.freshRolls = 0
+            turn.diceRolled = 6
+            game_state.roll(None, False)
+    return run
+
+
+def end_turn_long(count):
+    """GameState.end_turn of the last turn of a LONG game"""
+    game_state = long_game(9)
+    game_state.roll(None, False)
+    while game_state.turn.farkle:
+        game_state.turn.rolled = False
+        game_state.turn.freshRolls = 0
+        game_state.roll(None, False)
+    score = scoredice.ScoreDice(game_state.turn.dice)
+    hold = [idx for idx, used in enumerate(score.dice_used) if used]
+    games = [copy.deepcopy(game_state) for _ in range(count)]
+
+    def run():
+        for game in games:
+            game.end_turn(hold)
+    return run
+
+
+def get_save_dict(count):
+    """GameState.get_save_dict of a LONG game with 9 completed turns"""
+    game_state = long_game(9)
+
+    def run():
+        for _ in range(count):
+            game_state.get_save_dict()
+    return run
+
+
+def format_response(count):
+    """format_response of a LONG game with 9 completed turns"""
+    game_state = long_game(9)
+
+    def run():
+        for _ in range(count):
+            app.format_response(game_state)
+    return run
+
+
+def object_decoder(count):
+    """json.loads with object_decoder of a saved LONG game with 9 completed turns"""
+    body = json.dumps(long_game(9).get_save_dict())
+
+    def run():
+        for _ in range(count):
+            json.loads(body, object_hook=app.object_decoder)
+    return run
+
+
+# name -> (prepare, operations per run). prepare(count) does the setup and
+# returns a function that does count operations
+CASES = {'score_dice_%d' % num_dice: (score_dice(num_dice), 20000) for num_dice in range(1, 7)}
+CASES.update({
+    'game_roll': (game_roll, 2000),
+    'end_turn_long': (end_turn_long, 1000),
+    'get_save_dict': (get_save_dict, 10000),
+    'format_response': (format_response, 2000),
+    'object_decoder': (object_decoder, 2000),
+})
+
+
+def measure(prepare, count, repeat):
+    """best time of repeat runs, in microseconds per operation
+    """
+    best = None
+    for _ in range(repeat):
+        run = prepare(count)
+        # like timeit, so a collection does not land in one of the runs
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / count * 1e6
+
+
+def run_cases(names, repeat):
+    """Measure the cases. Returns {name: cost} where cost is the time of an
+       operation divided by the time of the calibration, measured right before
+       it so both see the machine running at the same speed
+    """
+    results = {}
+    for name in names:
+        prepare, count = CASES[name]
+        calibrate_us = measure(calibration, 100000, repeat)
+        results[name] = measure(prepare, count, repeat) / calibrate_us
+    return results
+
+
+def run_rounds(names, repeat, runs, combine):
+    """combine the costs of each case over runs rounds of run_cases
+    """
+    rounds = [run_cases(names, repeat) for _ in range(runs)]
+    return {name: combine([costs[name] for costs in rounds]) for name in names}
+
+
+def main():
+    """run the benchmarks and check them against the baselines
+    """
+    parser = argparse.ArgumentParser(description="benchmark the hot paths against baselines")
+    parser.add_argument('--update', action='store_true', help="save the results as the baselines")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help="percent slower that fails, default %(default)s")
+    parser.add_argument('--repeat', type=int, default=7, help="runs of each case in a round")
+    parser.add_argument('--runs', type=int, default=RUNS,
+                        help="rounds over the cases, default %(default)s")
+    parser.add_argument('case', nargs='*', help="only run these cases")
+    args = parser.parse_args()
+
+    # the score table is built on first use, which is not what is measured
+    scoredice.score_table()
+    names = args.case or list(CASES)
+
+    baseline = {}
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as infile:
+            baseline = json.load(infile)
+    if args.update or len(baseline) == 0:
+        baseline.update(run_rounds(names, args.repeat, args.runs, statistics.median))
+        with open(BASELINE, 'w') as out:
+            json.dump({name: round(cost, 3) for name, cost in sorted(baseline.items())},
+                      out, indent=2)
+            out.write('\n')
+        print("baselines saved to %s" % BASELINE)
+        return 0
+
+    results = run_rounds(names, args.repeat, args.runs, min)
+    for _ in range(RETRIES):
+        slow = [name for name in names if name in baseline and \
+                results[name] > baseline[name] * (1 + args.tolerance / 100)]
+        for name, cost in run_cases(slow, args.repeat).items():
+            results[name] = min(results[name], cost)
+
+    failed = []
+    # costs are in units of the calibration loop, not seconds
+    print("%-18s %10s %10s %8s" % ('case', 'baseline', 'now', 'change'))
+    for name, cost in results.items():
+        if name not in baseline:
+            print("%-18s %10s %10.2f %8s" % (name, '-', cost, 'new'))
+            continue
+        change = (cost / baseline[name] - 1.0) * 100
+        print("%-18s %10.2f %10.2f %+7.1f%%" % (name, baseline[name], cost, change))
+        if change > args.tolerance:
+            failed.append(name)
+    if len(failed) > 0:
+        print("slower than the baseline by more than %.0f%%: %s" % (args.tolerance,
+                                                                    ', '.join(failed)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
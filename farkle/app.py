@@ -1,30 +1,121 @@
 """This lambda function is for generating rolls for a farkle game online
 
 """
+import base64
 import json
+import collections
 import decimal
 import hashlib
-import boto3
-from boto3.dynamodb.conditions import Key
-from botocore.exceptions import ClientError
-import gamestate
-import player
-
+import os
+import random
+import threading
+import time
+import metrics
+import request_profiling
+import response_compression
+import storage
+# the game modules are imported where they are used, so a cold start only
+# pays for the ones the request needs
 
 # import requests
 
+# types from_item has to look inside or convert
+_CONTAINERS = (dict, list, decimal.Decimal)
+
+# the jackpot is spread over this many items in the games table, so that
+# every bet does not update the same item
+JACKPOT_SHARDS = 8
+# seconds to reuse the summed jackpot before reading the shards again
+JACKPOT_CACHE_SECONDS = 2.0
+# times to retry winning the jackpot when it changes while claiming it
+JACKPOT_CLAIM_ATTEMPTS = 5
+# seconds to wait before the second claim, doubled for each one after it. The
+# wait is a random part of that, so claims that conflicted do not meet again
+JACKPOT_CLAIM_BACKOFF = 0.02
+# players kept in memory by a warm container, and for how many seconds
+PLAYER_CACHE_SIZE = 512
+PLAYER_CACHE_SECONDS = 30.0
+# times to run a command when the session or player changed since it was read
+PLAYER_WRITE_ATTEMPTS = 3
+
+
+class TTLCache:
+    """Keep recently used values for a limited time. The least recently used
+       value is dropped when there are more than maxsize. Safe to share between
+       threads, since even get reorders the values.
+    """
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (expires, value), oldest use first
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """get the value, or None if it is not cached or has expired
+        """
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() > entry[0]:
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        """cache the value for the next ttl seconds
+        """
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def invalidate(self, key):
+        """forget the value, after it was changed
+        """
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        """forget everything
+        """
+        with self._lock:
+            self._items.clear()
+
+
+# commands shared_handler knows
+COMMANDS = ('start', 'roll', 'stop', 'unfarkle', 'buyboosts', 'login')
+
+# where the tables are kept: 'dynamodb', 'memory' or 'sqlite:<path>'
+STORAGE = os.environ.get('FARKLE_STORAGE', 'dynamodb')
+# the storage, kept while the container is warm
+_storage = None
+
+# the summed jackpot, under the key 'jackpot'
+_game_cache = TTLCache(1, JACKPOT_CACHE_SECONDS)
+# player items by player_id
+_player_cache = TTLCache(PLAYER_CACHE_SIZE, PLAYER_CACHE_SECONDS)
+
+
 class GameEncoder(json.JSONEncoder):
     """Encode numbers as int if it has no remainder part, otherwise float
     """
     def default(self, o):
+        import gamestate
+
         if isinstance(o, decimal.Decimal):
             if o % 1 > 0:
                 return float(o)
             else:
                 return int(o)
-        elif isinstance(o, gamestate.TurnState) or \
-             isinstance(o, gamestate.GameState) or \
-             isinstance(o, Exception):
+        elif isinstance(o, gamestate.TurnState):
+            return o.get_save_dict()
+        elif isinstance(o, gamestate.GameState):
+            return o.get_client_dict()
+        elif isinstance(o, Exception):
             return o.__dict__
         return super(GameEncoder, self).default(o)
 
@@ -34,6 +125,8 @@ def object_decoder(dct):
     """evaluate our dictionary and create the correct type of object
        then initialize that object with the dictionary
     """
+    import gamestate
+
     if 'uniqID' in dct:
         gs_temp = gamestate.GameState()
         gs_temp.init_dict(dct)
@@ -47,110 +140,288 @@ def object_decoder(dct):
 
 
 
+def from_item(value):
+    """Convert a value read from DynamoDB in one pass. Decimals become int if they
+       have no remainder part, otherwise float, and session and turn maps become
+       GameState and TurnState objects like object_decoder makes them
+    """
+    value_type = type(value)
+    if value_type is dict:
+        converted = {}
+        for key, item in value.items():
+            item_type = type(item)
+            if item_type is decimal.Decimal:
+                integer = int(item)
+                converted[key] = integer if integer == item else float(item)
+            elif item_type is dict or item_type is list:
+                converted[key] = from_item(item)
+            else:
+                converted[key] = item
+        return object_decoder(converted)
+    if value_type is list:
+        return [from_item(item) if type(item) in _CONTAINERS else item for item in value]
+    if value_type is decimal.Decimal:
+        integer = int(value)
+        return integer if integer == value else float(value)
+    return value
+
+
+
 def format_response(obj, headers=None, code=200):
     """format the object to return to client as an object to return from API method,
-       which includes statusCode and headers.
+       which includes statusCode and headers. A game state is reduced to the
+       fields the client uses.
     """
     if headers is None:
         headers = {
             "Access-Control-Allow-Origin": "*",
             "Content-Type": "application/json"
         }
+    with metrics.timer('format'):
+        if obj is not None and not isinstance(obj, dict):
+            import responses
+
+            obj = responses.project(obj)
+        body = json.dumps(obj, cls=GameEncoder, separators=(',', ':'))
     return {
         "statusCode": code,
         "headers": headers,
-        "body": json.dumps(obj, cls=GameEncoder)
+        "body": body
     }
 
 
-def get_dynamo():
-    """get the dynamodb data connection
+def get_storage():
+    """get the storage for the tables. It is created once per container and
+       reused by warm invocations, so they keep the same connections
+    """
+    global _storage
+    if _storage is None:
+        _storage = storage.open_storage(STORAGE)
+    return _storage
+
+
+def set_storage(db_conn):
+    """use db_conn for the tables from now on, and forget what was cached
+       from the one before
+    """
+    global _storage
+    _storage = db_conn
+    _game_cache.clear()
+    _player_cache.clear()
+
+
+def adjust_write(table_name, key_dict, adjustments):
+    """Build the write for a dict of adjustments. Strings are set, and
+       numbers are added to the current value
+    """
+    set_values = {}
+    add = {}
+    for key, value in adjustments.items():
+        if isinstance(value, str):
+            set_values[key] = value
+        else:
+            add[key] = value
+    write = {'table': table_name, 'key': key_dict}
+    if len(set_values) > 0:
+        write['set'] = set_values
+    if len(add) > 0:
+        write['add'] = add
+    return write
+
+
+def jackpot_keys():
+    """keys of the jackpot shards in the games table. The first is the original
+       farkle item, so the jackpot saved before sharding is kept
+    """
+    return [{'gamename': 'farkle' if idx == 0 else 'farkle#' + str(idx)} \
+            for idx in range(JACKPOT_SHARDS)]
+
+
+def cache_jackpot(shard_items):
+    """sum the jackpot shards and remember the total for a short time
     """
-    return boto3.resource('dynamodb', region_name='us-west-1')
+    total = sum(item.get('jackpot', 0) for item in shard_items)
+    _game_cache.put('jackpot', total)
+    return total
 
 
-def update_table(db_conn, table_name, key_dict, update_dict):
-    """Update the table based on list of updates. All updates must be numeric additions to the
-       current value. Must be negative to subtract
+def gamestate_writes(game_state):
+    """get the session and player writes to save the game state
     """
-    if update_dict is not None and len(update_dict) > 0:
-        updates = []
-        variables = {}
-        idx = 1
-        haszero = False
-        for key, value in update_dict.items():
-            if isinstance(value, str):
-                updates.append(key + " = :a" + str(idx))
+    import sessioncodec
+
+    writes = []
+    if game_state.has_changes():
+        # the session is one small binary attribute, so it is cheaper to put
+        # all of it than to update parts of it. This also rewrites sessions
+        # saved as maps in the compact form. It only replaces the version it
+        # was loaded from, so two commands on the same session can not both
+        # be saved. New sessions and maps have no version
+        saved_version = game_state.saved_version()
+        writes.append({
+            'table': 'sessions',
+            'put': sessioncodec.encode_item(game_state),
+            'expect': {'version': (None, 0) if saved_version == 0 else (saved_version,)}
+        })
+
+    if game_state.player_adjustments is not None and len(game_state.player_adjustments) > 0:
+        # every change to a player bumps its version, and only applies to the
+        # version the game state was based on
+        adjustments = dict(game_state.player_adjustments)
+        adjustments['version'] = 1
+        write = adjust_write('players', {'player_id': game_state.player_id}, adjustments)
+        if game_state.playerVersion is not None:
+            if game_state.playerVersion == 0:
+                write['expect'] = {'version': (None, 0)}
             else:
-                updates.append(key + " = if_not_exists(" + key + ",:zero) + :a" + str(idx))
-                haszero = True
-            variables[':a' + str(idx)] = value
-            idx += 1
-        if haszero:
-            variables[':zero'] = 0
-        update_string = "set " + ', '.join(updates)
-        table = db_conn.Table(table_name)
-        table.update_item(
-            Key=key_dict,
-            UpdateExpression=update_string,
-            ExpressionAttributeValues=variables,
-            ReturnValues="UPDATED_NEW"
-        )
+                write['expect'] = {'version': (game_state.playerVersion,)}
+        writes.append(write)
+    return writes
+
+
+def jackpot_claim_writes(shard_items, reset):
+    """writes that empty every jackpot shard and put reset in the first one. Each
+       expects the shard to still hold what was read, so the claim fails if the
+       jackpot grew in between
+    """
+    values = {item['gamename']: item.get('jackpot') for item in shard_items}
+    return [{
+        'table': 'games',
+        'key': key_dict,
+        'set': {'jackpot': reset if idx == 0 else 0},
+        'expect': {'jackpot': (values.get(key_dict['gamename']),)}
+    } for idx, key_dict in enumerate(jackpot_keys())]
+
 
 def update_gamestate(db_conn, game_state):
-    """save the game state to the dynamo db
+    """save the game state to the db. The session, player and game changes
+       are written in one transaction, so either all of them happen or none do.
+       The session is only written if it changed, and adjustments that are
+       empty are skipped.
+
+       Jackpot increments go to a random shard. Winning the jackpot drains all
+       the shards with conditional writes, retrying after a random wait if
+       another player added to it at the same time.
+
+       Raises ConditionFailed for 'sessions' if the session was saved since it
+       was loaded, and for 'players' if the player changed since it was read.
+       The cached player is dropped, so loading again gets the new one.
     """
-    table = db_conn.Table('sessions')
-    save_state = game_state.get_save_dict()
-    table.put_item(Item=save_state)
-    update_table(db_conn, 'players', {'player_id': game_state.player_id}, \
-        game_state.player_adjustments)
-    update_table(db_conn, 'games', {'gamename': 'farkle'}, game_state.game_adjust)
+    try:
+        _write_gamestate(db_conn, game_state)
+    except storage.ConditionFailed as error:
+        if 'players' in error.tables:
+            _player_cache.invalidate(game_state.player_id)
+        raise
+    if len(game_state.player_adjustments) > 0:
+        _player_cache.invalidate(game_state.player_id)
+
+
+def _write_gamestate(db_conn, game_state):
+    """do the writes for update_gamestate
+    """
+    game_adjust = dict(game_state.game_adjust)
+    increment = game_adjust.pop('jackpot', 0)
+    claimed = game_adjust.pop('jackpot_claim', None)
+
+    if claimed is None:
+        writes = gamestate_writes(game_state)
+        if increment != 0:
+            game_adjust['jackpot'] = increment
+        if len(game_adjust) > 0:
+            writes.append(adjust_write('games', random.choice(jackpot_keys()), game_adjust))
+        db_conn.write(writes)
+        jackpot = _game_cache.get('jackpot')
+        if increment != 0 and jackpot is not None:
+            _game_cache.put('jackpot', jackpot + increment)
+        game_state.mark_saved()
+        return
+
+    credits = game_state.player_adjustments.get('num_credits', 0)
+    for attempt in range(JACKPOT_CLAIM_ATTEMPTS):
+        if attempt > 0:
+            time.sleep(random.uniform(0, JACKPOT_CLAIM_BACKOFF * 2 ** (attempt - 1)))
+        shard_items = db_conn.get_many({'games': jackpot_keys()}, True)['games']
+        jackpot = sum(item.get('jackpot', 0) for item in shard_items)
+        # pay what is really in the jackpot, not what was loaded
+        game_state.player_adjustments['num_credits'] = credits - claimed + jackpot
+        writes = gamestate_writes(game_state) + \
+            jackpot_claim_writes(shard_items, game_state.JACKPOT_RESET + increment)
+        try:
+            db_conn.write(writes)
+        except storage.ConditionFailed as error:
+            if 'players' in error.tables or 'sessions' in error.tables or \
+                    attempt == JACKPOT_CLAIM_ATTEMPTS - 1:
+                raise
+        else:
+            game_state.balance += jackpot - claimed
+            game_state.jackpot = game_state.JACKPOT_RESET + increment
+            cache_jackpot([{'jackpot': game_state.jackpot}])
+            game_state.mark_saved()
+            return
 
 
 def load_game(db_conn):
-    """load game from db
+    """load game from db. The jackpot is the sum of its shards, reused for a
+       few seconds before reading them again
     """
-    table = db_conn.Table('games')
-    response = table.get_item(
-        Key={
-            'gamename': 'farkle'
-        }
-    )
-    if 'Item' not in response:
-        return {'jackpot': 0}
+    jackpot = _game_cache.get('jackpot')
+    if jackpot is None:
+        jackpot = cache_jackpot(db_conn.get_many({'games': jackpot_keys()})['games'])
+    return {'jackpot': jackpot}
+
+def player_from_item(item):
+    """create the player from its db item
+    """
+    import player
+
+    player_1 = player.Player()
+    player_1.init_dict(item)
+    return player_1
 
-    return response['Item']
 
-def load_player(db_conn, player_id):
-    """load player data from db
+def load_player(db_conn, player_id, use_cache=False, consistent=False):
+    """load player data from db. With use_cache, a player read in the last
+       PLAYER_CACHE_SECONDS by this container is used instead. consistent
+       reads the player with a strongly consistent read, and skips the cache
     """
+    if use_cache and not consistent:
+        item = _player_cache.get(player_id)
+        if item is not None:
+            return player_from_item(item)
     try:
-        table = db_conn.Table('players')
-        response = table.get_item(
-            Key={
-                'player_id': player_id
-            }
-        )
-        if 'Item' not in response:
-            return None
-        item = response['Item']
-        player_1 = player.Player()
-        player_1.init_dict(item)
-        return player_1
-    except ClientError:
+        if consistent:
+            items = db_conn.get_many({'players': [{'player_id': player_id}]}, True)['players']
+            item = items[0] if len(items) > 0 else None
+        else:
+            item = db_conn.get('players', {'player_id': player_id})
+    except storage.StorageError:
+        return None
+    if item is None:
         return None
+    _player_cache.put(player_id, item)
+    return player_from_item(item)
+
+
+def check_password(item, password):
+    """True if the password matches the hashed password of the player item
+    """
+    # use the player_id as the salt
+    test_password = \
+        hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), \
+                item['player_id'].encode('utf-8'), 1111)
+    return 'password' in item and test_password == item['password']
 
 
 def login_player(db_conn, username, password, displayname):
-    """handle login when we don't have the player_id
+    """handle login when we don't have the player_id. The usernames table maps
+       each username to its player_id, so this never scans the players table
     """
-    table = db_conn.Table('players')
-    response = table.scan(
-        FilterExpression=Key('username').eq(username)
-    )
-    items = response['Items']
-    if len(items) == 0:
+    import player
+
+    player_id = db_conn.get_username(username)
+    consistent = False
+    if player_id is None:
         #create a new player!
         player_1 = player.Player()
         player_1.password = hashlib.pbkdf2_hmac('sha256', \
@@ -159,68 +430,140 @@ def login_player(db_conn, username, password, displayname):
                                     1111)
         player_1.username = username
         player_1.displayname = displayname
-        item = player_1.get_save_dict()
-        table.put_item(Item=item)
-        return player_1
-
-    # we SHOULD only have one match. But our db doesn't guarnatee that
-    for item in items:
-        # use the player_id as the salt
-        test_password = \
-            hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), \
-                    item['player_id'].encode('utf-8'), 1111)
-        if 'password' in item and test_password == item['password']:
-            # set login key
-            player_1 = player.Player()
-            item['login_key'] = player_1.login_key
-            player_1.init_dict(item)
-            table.update_item(Key={'player_id': item['player_id']}, \
-                              UpdateExpression="set login_key=:key",
-                              ExpressionAttributeValues={':key': player_1.login_key},
-                              ReturnValues="UPDATED_NEW")
+        db_conn.put('players', player_1.get_save_dict())
+        # the username only belongs to the player once this succeeds
+        if db_conn.claim_username(username, player_1.player_id):
             return player_1
+        # someone else took the username first. Log in as them instead, with
+        # consistent reads, since they only just wrote the username and player
+        db_conn.delete('players', {'player_id': player_1.player_id})
+        consistent = True
+        player_id = db_conn.get_username(username, consistent)
+        if player_id is None:
+            return None
+
+    items = db_conn.get_many({'players': [{'player_id': player_id}]}, consistent)['players']
+    item = items[0] if len(items) > 0 else None
+    if item is not None and check_password(item, password):
+        # set login key
+        player_1 = player.Player()
+        item['login_key'] = player_1.login_key
+        player_1.init_dict(item)
+        _player_cache.invalidate(item['player_id'])
+        db_conn.update('players', {'player_id': item['player_id']},
+                       {'login_key': player_1.login_key})
+        return player_1
 
     #no password match
     return None
 
 
 
-def load_gamestate(db_conn, session):
-    """get the game state from the db
+def load_gamestate(db_conn, session, player_id=None, consistent=False):
+    """get the game state from the db. If the player_id is known, the session,
+       player and game are read in a single get_many. Otherwise the session
+       is read first and the player and game are read together after it.
+       The player and jackpot are only read if they are not cached. consistent
+       reads with strongly consistent reads and does not use the cached player
     """
+    import gamestate
+    import sessioncodec
+
     try:
-        table = db_conn.Table('sessions')
-        response = table.get_item(
-            Key={
-                'uniqID': session
-            }
-        )
-        player_1 = load_player(db_conn, response['Item']['player_id'])
-        game_data = load_game(db_conn)
-    except ClientError:
+        keys = {
+            'sessions': [{'uniqID': session}]
+        }
+        jackpot = _game_cache.get('jackpot')
+        if jackpot is None:
+            keys['games'] = jackpot_keys()
+        player_item = None
+        if player_id:
+            if not consistent:
+                player_item = _player_cache.get(str(player_id))
+            if player_item is None:
+                keys['players'] = [{'player_id': str(player_id)}]
+        items = db_conn.get_many(keys, consistent)
+        if len(items['sessions']) == 0:
+            raise KeyError(session)
+        item = items['sessions'][0]
+
+        if len(items.get('players', [])) > 0:
+            player_item = items['players'][0]
+            _player_cache.put(player_item['player_id'], player_item)
+        if player_item is None or player_item['player_id'] != item['player_id']:
+            player_item = None if consistent else _player_cache.get(item['player_id'])
+        if player_item is None:
+            player_items = db_conn.get_many({
+                'players': [{'player_id': item['player_id']}]
+            }, consistent)['players']
+            if len(player_items) > 0:
+                player_item = player_items[0]
+                _player_cache.put(player_item['player_id'], player_item)
+        player_1 = None
+        if player_item is not None:
+            player_1 = player_from_item(player_item)
+        if jackpot is None:
+            jackpot = cache_jackpot(items['games'])
+        game_data = {'jackpot': jackpot}
+    except storage.StorageError:
         game_state = gamestate.GameState()
         game_state.uniqID = session
         game_state.message = "Unknown game state"
         return game_state
     else:
-        item = response['Item']
-        game_state: gamestate.GameState = json.loads(json.dumps(item, cls=GameEncoder)\
-            , object_hook=object_decoder)
+        with metrics.timer('decode'):
+            if sessioncodec.is_encoded(item):
+                game_state: gamestate.GameState = sessioncodec.decode_item(item)
+            else:
+                game_state = from_item(item)
+            game_state.mark_saved()
         game_state.update_from_player(player_1)
         game_state.update_from_game(game_data)
         return game_state
 
 
+def run_command(db_conn, load, command, client_version=None):
+    """Load the game state with load(consistent), run command on it and save it
+       if command returns True. If the session or the player changed since it
+       was read, the command runs again on a game state loaded with consistent
+       reads, so it does not see the old ones again. If client_version is the
+       version loaded, the response is only what the command changed. Returns
+       the game state.
+    """
+    for attempt in range(PLAYER_WRITE_ATTEMPTS):
+        game_state = load(attempt > 0)
+        if client_version is not None and client_version == game_state.version:
+            import responses
+
+            responses.mark_base(game_state)
+        with metrics.timer('game'):
+            changed = command(game_state)
+        if not changed:
+            return game_state
+        game_state.version += 1
+        try:
+            update_gamestate(db_conn, game_state)
+        except storage.ConditionFailed as error:
+            if attempt == PLAYER_WRITE_ATTEMPTS - 1 or \
+                    ('players' not in error.tables and 'sessions' not in error.tables):
+                raise
+        else:
+            return game_state
+    return None
+
+
 def buyboost_handler(data):
     """handle boost buying
     """
-    db_conn = get_dynamo()
-
     # set our defaults
     if 'gems' in data:
-        game_state = load_gamestate(db_conn, data['session'])
-        if game_state.buy_boosts(int(data['gems'])):
-            update_gamestate(db_conn, game_state)
+        db_conn = get_storage()
+        game_state = run_command(
+            db_conn,
+            lambda consistent: load_gamestate(db_conn, data['session'],
+                                              data.get('player_id'), consistent),
+            lambda game_state: game_state.buy_boosts(int(data['gems'])),
+            data.get('version'))
 
         return format_response(game_state)
     else:
@@ -231,7 +574,6 @@ def roll_handler(data):
         and whether it is using the extra roll power up
         in the body
     """
-    db_conn = get_dynamo()
     # set our defaults
     if 'hold' not in data:
         data['hold'] = None
@@ -240,23 +582,31 @@ def roll_handler(data):
     if 'session' not in data:
         return format_response({'message': 'no session specified'}, None, 502)
 
-    game_state = load_gamestate(db_conn, data['session'])
-    if game_state.roll(data['hold'], data['extra']):
-        update_gamestate(db_conn, game_state)
+    db_conn = get_storage()
+
+    game_state = run_command(
+        db_conn,
+        lambda consistent: load_gamestate(db_conn, data['session'], data.get('player_id'),
+                                          consistent),
+        lambda game_state: game_state.roll(data['hold'], data['extra']),
+        data.get('version'))
 
     return format_response(game_state)
 
 def unfarkle_handler(data):
     """unfarkle
     """
-    db_conn = get_dynamo()
-
     if 'session' not in data:
         return format_response({'message': 'no session specified'}, None, 502)
 
-    game_state = load_gamestate(db_conn, data['session'])
-    if game_state.unfarkle():
-        update_gamestate(db_conn, game_state)
+    db_conn = get_storage()
+
+    game_state = run_command(
+        db_conn,
+        lambda consistent: load_gamestate(db_conn, data['session'], data.get('player_id'),
+                                          consistent),
+        lambda game_state: game_state.unfarkle(),
+        data.get('version'))
 
     return format_response(game_state)
 
@@ -264,8 +614,6 @@ def unfarkle_handler(data):
 def stop_handler(data):
     """End a turn. Go to the next turn or end the game.
     """
-    db_conn = get_dynamo()
-
     # set our defaults
     if 'hold' not in data:
         data['hold'] = None
@@ -274,10 +622,14 @@ def stop_handler(data):
     if 'session' not in data:
         return format_response({'message': 'no session specified'}, None, 502)
 
+    db_conn = get_storage()
 
-    game_state = load_gamestate(db_conn, data['session'])
-    if game_state.end_turn(data['hold'], data['double']):
-        update_gamestate(db_conn, game_state)
+    game_state = run_command(
+        db_conn,
+        lambda consistent: load_gamestate(db_conn, data['session'], data.get('player_id'),
+                                          consistent),
+        lambda game_state: game_state.end_turn(data['hold'], data['double']),
+        data.get('version'))
 
     return format_response(game_state)
 
@@ -291,6 +643,10 @@ def start_handler(data):
         session - if continuing existing game, include session. can also start a
          new game with previous session
     """
+    import gamestate
+    import player
+    import sessioncodec
+
     # set our defaults
     if 'bet' not in data:
         data['bet'] = 500
@@ -300,30 +656,44 @@ def start_handler(data):
         data['session'] = ''
     if 'player_id' not in data:
         data['player_id'] = ''
+    if data['mode'] not in sessioncodec.MODES:
+        return format_response({'message': 'unknown mode'}, None, 502)
 
     try:
-        db_conn = get_dynamo()
+        db_conn = get_storage()
 
         data['player_id'] = str(data['player_id'])
         if len(str(data['session'])) > 15:
-            game_state = load_gamestate(db_conn, data['session'])
-            if str(game_state.player_id) != data['player_id']:
-                game_state.message = "wrong player id"
-                return format_response(game_state, None, 502)
+            def load(consistent):
+                return load_gamestate(db_conn, data['session'], data['player_id'], consistent)
+        else:
+            def load(consistent):
+                game_state = gamestate.GameState()
+                # create new player if play_id not set
+                if data['player_id'] == '':
+                    player_1 = player.Player()
+                else:
+                    player_1 = load_player(db_conn, data['player_id'], True, consistent)
+                game_state.gameMode = data['mode']
+                game_state.update_from_player(player_1)
+                return game_state
+
+        # only a loaded session can belong to another player. A new player
+        # gets a new id
+        check_player = len(str(data['session'])) > 15
+
+        def start(game_state):
+            if check_player and str(game_state.player_id) != data['player_id']:
+                return False
             if game_state.gameOver:
                 game_state.gameMode = data['mode']
-        else:
-            game_state = gamestate.GameState()
-            # create new player if play_id not set
-            if data['player_id'] == '':
-                player_1 = player.Player()
-            else:
-                player_1 = load_player(db_conn, data['player_id'])
-            game_state.gameMode = data['mode']
-            game_state.update_from_player(player_1)
+            game_state.start_turn(int(data['bet']))
+            return True
 
-        game_state.start_turn(int(data['bet']))
-        update_gamestate(db_conn, game_state)
+        game_state = run_command(db_conn, load, start)
+        if check_player and str(game_state.player_id) != data['player_id']:
+            game_state.message = "wrong player id"
+            return format_response(game_state, None, 502)
 
         return format_response(game_state)
     except Exception as exception:
@@ -332,7 +702,9 @@ def start_handler(data):
 def login_handler(data):
     """Get the player data. May require a password (but not yet)
     """
-    db_conn = get_dynamo()
+    import player
+
+    db_conn = get_storage()
     game = load_game(db_conn)
     player_1: player.Player = None
     if 'player_id' in data and data['player_id'] != '':
@@ -353,14 +725,59 @@ def login_handler(data):
 
 
 def shared_handler(event, context):
-    """handle multiple functions based on path
+    """handle multiple functions based on path. The time spent in each phase
+       is logged as metrics by command, and requests picked for profiling are
+       run under the profiler
+    """
+    if request_profiling.ENABLED and request_profiling.should_profile(event):
+        command = event['pathParameters']['command']
+        return request_profiling.profile(command if command in COMMANDS else 'unknown',
+                                         handle_event, event)
+    return handle_event(event)
+
+
+def handle_event(event):
+    """handle the request, with its metrics. The response is compressed if
+       the request accepts it
     """
     command = event['pathParameters']['command']
+    # metrics are grouped by command, so do not make a group per unknown command
+    metrics.start(command if command in COMMANDS else 'unknown')
+    response = None
+    try:
+        response = run_handler(command, event)
+        response = response_compression.compress_response(response, event.get('headers'))
+    finally:
+        metrics.finish(0 if response is None else response['statusCode'])
+    return response
+
+
+def run_handler(command, event):
+    """parse the body and call the handler for the command. A write that still
+       conflicts after the retries, or storage that fails, is an error response
+    """
+    try:
+        return dispatch(command, event)
+    except storage.ConditionFailed:
+        return format_response({'message': 'the game changed at the same time, try again'},
+                               None, 502)
+    except storage.StorageError as error:
+        return format_response({'message': str(error)}, None, 502)
+
+
+def dispatch(command, event):
+    """parse the body and call the handler for the command
+    """
     data = {}
     if 'body' in event:
         body = event['body']
+        # every media type is binary to API Gateway, so it may send the body
+        # base64 encoded
+        if event.get('isBase64Encoded') and body is not None:
+            body = base64.b64decode(body).decode('utf-8')
         if body.startswith('{'):
-            data = json.loads(body)
+            with metrics.timer('parse'):
+                data = json.loads(body)
         else:
             data = {}
 
@@ -378,3 +795,19 @@ def shared_handler(event, context):
         return login_handler(data)
     else:
         return format_response({'message': 'unknown command'}, None, 502)
+
+
+if os.environ.get('AWS_LAMBDA_INITIALIZATION_TYPE') == 'provisioned-concurrency':
+    # provisioned containers are initialized before any request reaches them,
+    # so load everything now instead of on the first request. On demand
+    # containers wait for this, and not every command needs it, so there it
+    # is done on first use
+    import gamestate
+    import player
+    import scoredice
+
+    if isinstance(get_storage(), storage.DynamoStorage):
+        storage.get_dynamo()
+    scoredice.score_table()
+    player.Player()
+    gamestate.GameState()
@@ -0,0 +1,54 @@
+"""This module generates dice rolls weighted towards 1, with the same
+   distribution as TurnState.rand, but a whole roll at a time
+"""
+import functools
+import itertools
+import random
+
+SIDES = 6
+FACES = list(range(1, SIDES + 1))
+
+
+def face_probabilities(screws):
+    """probability of each face 1 to 6 for TurnState.rand(screws). index 0 is unused.
+       1 comes up with probability screws/6 and the other faces share the rest evenly.
+    """
+    one = min(max(screws / SIDES, 0.0), 1.0)
+    return [0.0, one] + [(1.0 - one) / (SIDES - 1)] * (SIDES - 1)
+
+
+class WeightedDie:
+    """Rolls dice for one value of screws. Use weighted_die to get a cached one.
+    """
+    def __init__(self, screws):
+        self.screws = screws
+        self.probabilities = face_probabilities(screws)
+        # cumulative probability of rolling at most each face
+        self.cdf = list(itertools.accumulate(self.probabilities[1:]))
+        # guard against the last value rounding to just under 1.0
+        self.cdf[-1] = 1.0
+
+    def roll(self, count, rng=random):
+        """roll count dice, returned as a list of faces 1 to 6
+        """
+        return rng.choices(FACES, cum_weights=self.cdf, k=count)
+
+    def roll_batch(self, num_rolls, count, rng=None):
+        """Roll num_rolls rolls of count dice each, for simulation. Returns a
+           numpy integer array of shape (num_rolls, count). rng is a numpy
+           Generator, so batches can use independent streams.
+           Requires numpy.
+        """
+        import numpy as np
+
+        if rng is None:
+            rng = np.random.default_rng()
+        uniform = rng.random((num_rolls, count))
+        return np.searchsorted(np.array(self.cdf[:-1]), uniform, side='right') + 1
+
+
+@functools.lru_cache(maxsize=128)
+def weighted_die(screws):
+    """get the die for the given screws, building its distribution the first time
+    """
+    return WeightedDie(screws)
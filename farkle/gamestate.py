@@ -4,6 +4,8 @@ import random
 import math
 import uuid
 import datetime
+import dice
+import metrics
 import scoredice
 import player
 
@@ -11,6 +13,19 @@ class GameState:
     """Track the game state for farkle game
     """
     _goallevels = [5000, 8000, 10000, 12000, 15000, 20000, 25000, 30000]
+    # the jackpot starts again at this after it is won
+    JACKPOT_RESET = 10000
+    # fields saved in the sessions table
+    SAVED = ('uniqID', 'turn', 'turns', 'turnBet', 'gameMode', 'tutorialStep', 'won', 'wonGame',
+             'boostBonus', 'gameOver', 'hasExtra', 'hasDoubled', 'hasUndone', '_goal',
+             'player_id', 'version')
+    # fields sent to the client, which are the saved fields and those that
+    # come from the player and game
+    CLIENT = SAVED + ('message', 'jackpot', 'game_adjust', 'balance', 'numBoosts', 'numGems',
+                      'amountBet', 'amountEarned', 'numTurns', 'last_bonus', 'player_adjustments')
+    # attributes for tracking changes, which are not sent to the client
+    _tracking = ('_saved', '_savedTurns', 'playerVersion', '_base')
+    __slots__ = CLIENT + _tracking
 
     def __init__(self):
         self.uniqID = str(uuid.uuid4())
@@ -56,6 +71,9 @@ class GameState:
         self.message = None
         # player id session is for
         self.player_id = None
+        # goes up by one every time the game state is saved, so a client can
+        # ask for only what changed since the version it has
+        self.version = 0
 
 
         # GAME PROPERTIES
@@ -81,38 +99,73 @@ class GameState:
         self.numTurns = 0
         self.last_bonus = ''
         self.player_adjustments = {}
+        # version of the player item the balances came from, None if unknown
+        self.playerVersion = None
+
+        # TRACKING, not saved or sent to the client
+        # the saved values of each field, None if never saved
+        self._saved = None
+        # the turn objects that were in turns when saved
+        self._savedTurns = []
+        # what the client had, if the response is to be what changed since
+        self._base = None
 
     def init_dict(self, dct):
-        """Initialize this object from a dictionary. Used when deserializing
+        """Initialize this object from a dictionary. Used when deserializing.
+           Only saved fields are set, anything else in the item is ignored
         """
-        for key in dct.keys():
-            setattr(self, key, dct[key])
+        for key in GameState.SAVED:
+            if key in dct:
+                setattr(self, key, dct[key])
 
     def get_save_dict(self):
         """gather all the properties to save to the db
         """
-        return {
-            'uniqID': self.uniqID,
-            'turn': self.turn.get_save_dict(),
-            'turns': [t.get_save_dict() for t in self.turns],
-            'turnBet': self.turnBet,
-            'gameMode': self.gameMode,
-            'tutorialStep': self.tutorialStep,
-            'won': self.won,
-            'wonGame': self.wonGame,
-            'boostBonus': self.boostBonus,
-            'gameOver': self.gameOver,
-            'hasExtra': self.hasExtra,
-            'hasDoubled': self.hasDoubled,
-            'hasUndone': self.hasUndone,
-            '_goal': self._goal,
-            'player_id': self.player_id
-        }
+        save = {key: getattr(self, key) for key in GameState.SAVED}
+        save['turn'] = self.turn.get_save_dict()
+        save['turns'] = [t.get_save_dict() for t in self.turns]
+        return save
+
+    def get_client_dict(self):
+        """get the values to return to client
+        """
+        return {key: getattr(self, key) for key in GameState.CLIENT}
+
+    def mark_saved(self):
+        """remember what is in the db now, so has_changes is False until it changes
+        """
+        self._saved = self.get_save_dict()
+        self._saved['turn']['dice'] = list(self.turn.dice)
+        del self._saved['turns']
+        self._savedTurns = list(self.turns)
+
+    def saved_version(self):
+        """the version when mark_saved was called, or 0 if it never was
+        """
+        return 0 if self._saved is None else self._saved['version']
+
+    def has_changes(self):
+        """True if the game state was never saved or changed since mark_saved.
+           Completed turns are not changed, so turns is compared by identity
+        """
+        if self._saved is None:
+            return True
+        if len(self.turns) != len(self._savedTurns) or \
+                any(turn is not saved for turn, saved in zip(self.turns, self._savedTurns)):
+            return True
+        for key in GameState.SAVED:
+            if key == 'turn':
+                if self.turn.get_save_dict() != self._saved['turn']:
+                    return True
+            elif key != 'turns' and getattr(self, key) != self._saved[key]:
+                return True
+        return False
 
     def update_from_player(self, player_1: player.Player):
         """get info from player object and update our state
         """
         self.player_id = player_1.player_id
+        self.playerVersion = player_1.version
         self.balance = player_1.num_credits
         self.numGems = player_1.num_gems
         if 'num_farkle_boosts' in player_1.farkle:
@@ -242,22 +295,10 @@ class GameState:
             self.player_adjustments['farkle.num_farkle_boosts'] = -1
             self.turn.extra_roll()
         else:
-            screws = 1.0
-            if self.numTurns > 10 and self.amountEarned > 5000:
-                # calculate average win
-                ratio = (self.amountBet / self.amountEarned)*0.9  # target 90%
-                if ratio > 2.5:
-                    ratio = 2.5
-                elif ratio < 0.5:
-                    ratio = 0.5
-                screws = ratio
-            elif self.amountEarned == 0:
-                screws = 3.0
             self.message = "rolling %s dice" % self.turn.diceRolled
-            self.turn.roll(screws)
+            self.turn.roll(self.get_screws())
 
-        score = scoredice.ScoreDice(self.turn.dice)
-        self.turn.farkle = score.total_points == 0
+        self.turn.farkle = self.turn.roll_points() == 0
         if self.turn.farkle:
             self.turn.set_points(0)
 
@@ -270,6 +311,23 @@ class GameState:
 
         return True
 
+    def get_screws(self):
+        """calculate how much the dice are weighted towards 1 for this player.
+           1.0 is a fair die.
+        """
+        screws = 1.0
+        if self.numTurns > 10 and self.amountEarned > 5000:
+            # calculate average win
+            ratio = (self.amountBet / self.amountEarned)*0.9  # target 90%
+            if ratio > 2.5:
+                ratio = 2.5
+            elif ratio < 0.5:
+                ratio = 0.5
+            screws = ratio
+        elif self.amountEarned == 0:
+            screws = 3.0
+        return screws
+
     def goalAmount(self):
         """calculate the amount needed to continue winning
         """
@@ -310,11 +368,12 @@ class GameState:
             self.hasDoubled = True
 
         if self.turn.points >= 10000:
-            # get the jackpot!!!
-            self.game_adjust['jackpot'] = -self.jackpot + 10000
+            # get the jackpot!!! The saved jackpot is drained and reset when saving,
+            # and the credits are corrected if it changed since it was loaded
+            self.game_adjust['jackpot_claim'] = self.jackpot
             self.player_adjustments['num_credits'] = self.jackpot
             self.balance += self.jackpot
-            self.jackpot = 1000
+            self.jackpot = GameState.JACKPOT_RESET
         else:
             self.player_adjustments['num_credits'] = 0
 
@@ -409,16 +468,13 @@ class GameState:
                     self.message = "held after farkle not allowed"
                     return False # cannot hold anything after farkle (makes no sense?)
 
-                # score the dice held
-                held = list(map(lambda i: self.turn.dice[i], hold))
-                score = scoredice.ScoreDice(held)
-                # if any dice not used, return False
-                if False in score.dice_used:
-                    print(score.__dict__)
+                # score the dice held. invalid if any dice not used
+                points = self.turn.hold_points(hold)
+                if points < 0:
                     self.message = "invalid dice held"
                     return False
 
-                self.turn.add_points(score.total_points)
+                self.turn.add_points(points)
                 # set how many dice to roll next time.
                 self.turn.diceRolled -= len(hold)
                 if self.turn.diceRolled == 0:
@@ -433,6 +489,13 @@ class GameState:
 class TurnState:
     """track the state of the current turn
     """
+    # fields saved with the turn, and sent to the client
+    SAVED = ('unboostedPoints', 'points', 'savePoints', 'diceRolled', 'dice', 'rolled', 'farkle',
+             'hasUndone', 'unfarkled', 'hasExtra', 'hasDoubled', 'freshRolls')
+    # attributes computed from the dice, which are not saved
+    _cached = ('_holdPoints', '_holdLegal')
+    __slots__ = SAVED + _cached
+
     def __init__(self):
         # the points earned before power up used.
         self.unboostedPoints = 0
@@ -459,18 +522,25 @@ class TurnState:
         self.hasDoubled = False
         # number of times we have rolled all 6 dice this turn
         self.freshRolls = 0
+        # points for each subset of dice that can be held, indexed by bitmask
+        # of the dice indexes. None until the dice are scored
+        self._holdPoints = None
+        # bit m set if holding subset m is allowed
+        self._holdLegal = 0
         self.reset_game()
 
     def init_dict(self, dct):
-        """Initialize this object from a dictionary. Used when deserializing
+        """Initialize this object from a dictionary. Used when deserializing.
+           Only saved fields are set, anything else in the item is ignored
         """
-        for key in dct.keys():
-            setattr(self, key, dct[key])
+        for key in TurnState.SAVED:
+            if key in dct:
+                setattr(self, key, dct[key])
 
     def get_save_dict(self):
         """get the dictionary to save for the state of this turn
         """
-        return self.__dict__
+        return {key: getattr(self, key) for key in TurnState.SAVED}
 
     def reset_game(self):
         """reset for a new game, which may have multiple turns
@@ -520,6 +590,7 @@ class TurnState:
             self.diceRolled = 6
         #
         self.rolled = True
+        self.score_holds()
 
 
     def roll(self, screws=1.0):
@@ -531,8 +602,37 @@ class TurnState:
         self.unfarkled = False
         if self.diceRolled == 6:
             self.freshRolls = self.freshRolls + 1
-        self.dice = list(map(lambda x: self.rand(screws), range(self.diceRolled)))
+        self.dice = dice.weighted_die(screws).roll(self.diceRolled)
         self.rolled = True
+        self.score_holds()
+
+    def score_holds(self):
+        """score every subset of the dice once, so holds can be checked by bitmask
+        """
+        with metrics.timer('score'):
+            self._holdPoints, self._holdLegal = scoredice.score_subsets(self.dice)
+
+    def roll_points(self):
+        """get the points for all the dice rolled. 0 is a farkle
+        """
+        if self._holdPoints is None:
+            self.score_holds()
+        return self._holdPoints[-1]
+
+    def hold_points(self, hold):
+        """get the points for holding the dice at the given indexes, or -1
+           if the hold is not allowed
+        """
+        if self._holdPoints is None:
+            self.score_holds()
+        mask = 0
+        for idx in hold:
+            if idx < 0 or idx >= len(self.dice) or mask & (1 << idx):
+                return -1
+            mask |= 1 << idx
+        if not (self._holdLegal >> mask) & 1:
+            return -1
+        return self._holdPoints[mask]
 
     def unroll(self):
         """undo the farkle roll previously
@@ -578,7 +678,7 @@ class TurnState:
     def rand(self, screws):
         """return single int between 1 and 6 inclusive, which is
            weighted by screws. The higher screws, the more likely
-           to return 1
+           to return 1. roll uses dice.WeightedDie, which has the same distribution
         """
         frandom = random.random()
         boundary = (1.0/scoredice.ScoreDice.SIDES)*screws
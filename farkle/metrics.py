@@ -0,0 +1,180 @@
+"""Timing of each invocation by phase, written as one CloudWatch embedded
+   metric format (EMF) log line when the invocation ends, so CloudWatch turns
+   the phases into metrics by command without an agent.
+
+   Phases are timed with timer(name), and nest: 'score' is part of 'game'.
+   Storage calls are timed under the name of the DynamoDB operation, along
+   with the capacity they consumed. Sizes, like the bytes of the response,
+   are added with size(name, num_bytes).
+
+   On by default when running in lambda. FARKLE_METRICS=1 or 0 overrides that.
+"""
+import json
+import os
+import threading
+import time
+
+NAMESPACE = 'Farkle'
+ENABLED = os.environ.get('FARKLE_METRICS',
+                         '1' if 'AWS_LAMBDA_FUNCTION_NAME' in os.environ else '0') == '1'
+
+# each thread handles one invocation at a time
+_local = threading.local()
+
+
+class Invocation:
+    """What one invocation spent its time on
+    """
+    def __init__(self, command):
+        self.command = command
+        self.start = time.perf_counter()
+        # phase -> seconds
+        self.timings = {}
+        self.storage_calls = 0
+        # 'read' or 'write' -> capacity units
+        self.capacity = {'read': 0.0, 'write': 0.0}
+        # table name -> capacity units
+        self.table_capacity = {}
+        # name -> bytes
+        self.sizes = {}
+
+    def add_time(self, name, seconds):
+        """add time spent in a phase
+        """
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def add_capacity(self, kind, consumed):
+        """add the ConsumedCapacity of a DynamoDB response, which is a dict
+           for one table or a list of them
+        """
+        if isinstance(consumed, dict):
+            consumed = [consumed]
+        for entry in consumed:
+            units = float(entry.get('CapacityUnits', 0))
+            self.capacity[kind] += units
+            table_name = entry.get('TableName', '')
+            self.table_capacity[table_name] = self.table_capacity.get(table_name, 0.0) + units
+
+    def add_size(self, name, num_bytes):
+        """add bytes to a size
+        """
+        self.sizes[name] = self.sizes.get(name, 0) + num_bytes
+
+    def record(self, status):
+        """the EMF log record
+        """
+        record = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': NAMESPACE,
+                    'Dimensions': [['command']],
+                    'Metrics': [{'Name': name, 'Unit': 'Milliseconds'} \
+                                for name in ['duration'] + sorted(self.timings)] + \
+                               [{'Name': name, 'Unit': 'Count'} \
+                                for name in ('storage_calls', 'read_capacity', 'write_capacity')] + \
+                               [{'Name': name, 'Unit': 'Bytes'} for name in sorted(self.sizes)]
+                }]
+            },
+            'command': self.command,
+            'status': status,
+            'duration': round((time.perf_counter() - self.start) * 1000, 3),
+            'storage_calls': self.storage_calls,
+            'read_capacity': self.capacity['read'],
+            'write_capacity': self.capacity['write'],
+            # not a metric, but searchable in the logs
+            'table_capacity': self.table_capacity,
+        }
+        for name, seconds in self.timings.items():
+            record[name] = round(seconds * 1000, 3)
+        record.update(self.sizes)
+        return record
+
+
+class _Timer:
+    """adds the time spent inside the with block to the invocation
+    """
+    __slots__ = ('invocation', 'name', 'start')
+
+    def __init__(self, invocation, name):
+        self.invocation = invocation
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.invocation.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NoTimer:
+    """timer used when there is no invocation being measured
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_TIMER = _NoTimer()
+
+
+def start(command):
+    """begin measuring an invocation of the command on this thread
+    """
+    if ENABLED:
+        _local.invocation = Invocation(command)
+
+
+def current():
+    """the invocation being measured on this thread, or None
+    """
+    return getattr(_local, 'invocation', None)
+
+
+def timer(name):
+    """context manager that adds the time inside it to the phase name
+    """
+    invocation = getattr(_local, 'invocation', None)
+    if invocation is None:
+        return _NO_TIMER
+    return _Timer(invocation, name)
+
+
+def storage_call(name, seconds, kind=None, consumed=None):
+    """record a call to the storage, and the capacity it consumed
+    """
+    invocation = getattr(_local, 'invocation', None)
+    if invocation is None:
+        return
+    invocation.add_time(name, seconds)
+    invocation.storage_calls += 1
+    if consumed is not None:
+        invocation.add_capacity(kind, consumed)
+
+
+def size(name, num_bytes):
+    """add bytes to the size name, such as the bytes in the response
+    """
+    invocation = getattr(_local, 'invocation', None)
+    if invocation is not None:
+        invocation.add_size(name, num_bytes)
+
+
+def finish(status):
+    """end the invocation and write its log line. Returns the record, or None
+       if nothing was measured
+    """
+    invocation = getattr(_local, 'invocation', None)
+    if invocation is None:
+        return None
+    _local.invocation = None
+    record = invocation.record(status)
+    print(json.dumps(record), flush=True)
+    return record
@@ -5,6 +5,22 @@ import uuid
 class Player:
     """represents a player in our system
     """
+    # fields saved in the players table
+    SAVED = ('farkle', 'num_gems', 'num_credits', 'player_id', 'login_key', 'username',
+             'password', 'displayname', 'version')
+    # name sent to the client -> field, or (field, key) for a value in a dict field
+    CLIENT = {
+        'player_id': 'player_id',
+        'numBoosts': ('farkle', 'num_farkle_boosts'),
+        'numTurns': ('farkle', 'games_played'),
+        'numGems': 'num_gems',
+        'balance': 'num_credits',
+        'login_key': 'login_key',
+        'username': 'username',
+        'displayname': 'displayname',
+    }
+    __slots__ = SAVED
+
     def __init__(self):
         self.farkle = {
             'num_farkle_boosts': 0,
@@ -20,28 +36,29 @@ class Player:
         self.username = ''
         self.password = ''
         self.displayname = ''
+        # incremented on every update, to detect changes since it was read
+        self.version = 0
 
     def init_dict(self, dct):
-        """Initialize this object from a dictionary. Used when deserializing
+        """Initialize this object from a dictionary. Used when deserializing.
+           Only saved fields are set, anything else in the item is ignored
         """
-        for key in dct.keys():
-            setattr(self, key, dct[key])
+        for key in Player.SAVED:
+            if key in dct:
+                setattr(self, key, dct[key])
 
     def get_save_dict(self):
         """get the attributes to write to database
         """
-        return self.__dict__
+        return {key: getattr(self, key) for key in Player.SAVED}
 
     def get_client_dict(self):
         """get the values to return to client. May not want all of them
         """
-        return {
-            'player_id': self.player_id,
-            'numBoosts': self.farkle['num_farkle_boosts'],
-            'numTurns': self.farkle['games_played'],
-            'numGems': self.num_gems,
-            'balance': self.num_credits,
-            'login_key': self.login_key,
-            'username': self.username,
-            'displayname': self.displayname
-        }
+        client = {}
+        for name, field in Player.CLIENT.items():
+            if isinstance(field, tuple):
+                client[name] = getattr(self, field[0])[field[1]]
+            else:
+                client[name] = getattr(self, field)
+        return client
@@ -0,0 +1,106 @@
+"""Opt-in profiling of single requests in production. A profiled request runs
+   under cProfile and tracemalloc, and the top functions by cumulative time and
+   the top allocation sites are logged, or written to a folder.
+
+   Requests are profiled at random with FARKLE_PROFILE_RATE (0 to 1), or when
+   the X-Farkle-Profile header matches the secret in FARKLE_PROFILE_TOKEN.
+   FARKLE_PROFILE_TOP sets how many entries to report, and FARKLE_PROFILE_DIR
+   a folder for the reports and the raw cProfile stats, instead of the log.
+
+   With neither set, shared_handler only checks ENABLED.
+"""
+import hmac
+import io
+import json
+import os
+import random
+import time
+
+RATE = float(os.environ.get('FARKLE_PROFILE_RATE', '0'))
+TOKEN = os.environ.get('FARKLE_PROFILE_TOKEN', '')
+TOP = int(os.environ.get('FARKLE_PROFILE_TOP', '20'))
+OUTPUT_DIR = os.environ.get('FARKLE_PROFILE_DIR', '')
+HEADER = 'x-farkle-profile'
+
+ENABLED = RATE > 0 or TOKEN != ''
+
+
+def should_profile(event):
+    """True if this request is sampled or asks to be profiled with the token
+    """
+    if TOKEN != '':
+        for name, value in (event.get('headers') or {}).items():
+            if name.lower() == HEADER and value is not None:
+                # the token is a secret, so do not leak it through timing
+                if hmac.compare_digest(value.encode('utf-8'), TOKEN.encode('utf-8')):
+                    return True
+    return RATE > 0 and random.random() < RATE
+
+
+def profile(name, func, *args):
+    """Call func(*args) under cProfile and tracemalloc, report where the time
+       and memory went, and return what func returned
+    """
+    import cProfile
+    import tracemalloc
+
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    try:
+        return profiler.runcall(func, *args)
+    finally:
+        seconds = time.perf_counter() - start
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        if started_tracing:
+            tracemalloc.stop()
+        report(name, seconds, profiler, snapshot, peak)
+
+
+def hotspots(profiler, top):
+    """the top functions by cumulative time, as text lines
+    """
+    import pstats
+
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats('cumulative').print_stats(top)
+    return [line for line in out.getvalue().splitlines() if line.strip() != '']
+
+
+def allocations(snapshot, top):
+    """the top lines by memory allocated and still alive, as text lines
+    """
+    import tracemalloc
+
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+    ])
+    return [str(stat) for stat in snapshot.statistics('lineno')[:top]]
+
+
+def report(name, seconds, profiler, snapshot, peak):
+    """log the profile of a request, or write it to OUTPUT_DIR. Returns the report
+    """
+    result = {
+        'profile': name,
+        'duration': round(seconds * 1000, 3),
+        'peak_memory': peak,
+        'hotspots': hotspots(profiler, TOP),
+        'allocations': allocations(snapshot, TOP),
+    }
+    if OUTPUT_DIR == '':
+        print(json.dumps(result), flush=True)
+        return result
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    base = os.path.join(OUTPUT_DIR, "%s-%d-%d" % (name, int(time.time() * 1000), os.getpid()))
+    # the raw stats can be loaded with pstats or snakeviz
+    profiler.dump_stats(base + '.prof')
+    with open(base + '.json', 'w') as out:
+        json.dump(result, out, indent=1)
+    return result
@@ -0,0 +1,103 @@
+"""Compression of response bodies with gzip or deflate, picked from the
+   Accept-Encoding header of the request. Compressed bodies are returned base64
+   encoded with isBase64Encoded, which API Gateway turns back into bytes since
+   the template lists every media type as binary.
+
+   Bodies under FARKLE_COMPRESS_MIN_BYTES (1024 by default) are sent as they
+   are, since compressing them saves too little to pay for itself.
+   FARKLE_COMPRESS_LEVEL sets the zlib level, 6 by default.
+"""
+import base64
+import os
+import zlib
+import metrics
+
+MIN_BYTES = int(os.environ.get('FARKLE_COMPRESS_MIN_BYTES', '1024'))
+LEVEL = int(os.environ.get('FARKLE_COMPRESS_LEVEL', '6'))
+# content coding -> what to add to the zlib window bits for its header, in
+# order of preference. HTTP deflate is the zlib format, not raw deflate
+ENCODINGS = {'gzip': 16, 'deflate': 0}
+
+
+def get_header(headers, name):
+    """the value of the header, whose name is in any case, or None
+    """
+    for key, value in (headers or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def choose_encoding(accept_encoding):
+    """the content coding in ENCODINGS the client prefers, or None. Codings
+       with q=0 are refused, and * stands for any coding not listed
+    """
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.partition(';')
+        weight = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name.strip().lower()] = weight
+
+    best = None
+    best_weight = 0.0
+    for encoding in ENCODINGS:
+        weight = weights.get(encoding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best = encoding
+            best_weight = weight
+    return best
+
+
+def vary(response):
+    """a copy of the response with Vary: Accept-Encoding, since whether its
+       body is compressed depends on that header
+    """
+    response_headers = dict(response.get('headers') or {})
+    response_headers['Vary'] = 'Accept-Encoding'
+    varied = dict(response)
+    varied['headers'] = response_headers
+    return varied
+
+
+def compress_response(response, headers):
+    """compress the body of the response if the request headers accept it.
+       Returns the response, or a copy of it that is compressed or only has
+       the Vary header added
+    """
+    body = response.get('body')
+    if not isinstance(body, str) or response.get('isBase64Encoded'):
+        return response
+    raw = body.encode('utf-8')
+    metrics.size('response_bytes', len(raw))
+    if len(raw) < MIN_BYTES:
+        return vary(response)
+    encoding = choose_encoding(get_header(headers, 'accept-encoding'))
+    if encoding is None:
+        return vary(response)
+
+    with metrics.timer('compress'):
+        # a window no bigger than the body, since setting up the whole 32KB
+        # window takes longer than compressing a small body
+        window_bits = min(15, max(9, len(raw).bit_length()))
+        compressor = zlib.compressobj(LEVEL, zlib.DEFLATED, ENCODINGS[encoding] + window_bits)
+        data = compressor.compress(raw) + compressor.flush()
+        if len(data) >= len(raw):
+            return vary(response)
+        encoded = base64.b64encode(data).decode('ascii')
+    metrics.size('compressed_bytes', len(data))
+    metrics.size('bytes_saved', len(raw) - len(data))
+
+    compressed = vary(response)
+    compressed['headers']['Content-Encoding'] = encoding
+    compressed['body'] = encoded
+    compressed['isBase64Encoded'] = True
+    return compressed
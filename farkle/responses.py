@@ -0,0 +1,113 @@
+"""Projection of the game state onto the fields returned to the client. The
+   projection of each class and set of fields is compiled once into a function
+   that reads all the fields with one attrgetter, so format_response gets plain
+   dicts and lists that json encodes without calling back into python for
+   every object.
+
+   A client that sends the version of the game state it has gets a delta
+   instead, if that is still the version in the db:
+     {"version": 8, "base": 7, "changes": {...}}
+   changes has the fields that are different, except that turn has only the
+   fields of the turn that are different, and turnsAdded has the turns
+   appended to turns. If turns was replaced, all of it is in turns. The
+   fields in EXTERNAL_FIELDS are always in changes, since the version only
+   covers the session.
+"""
+import operator
+import gamestate
+
+# game state fields that are only used by the server. player_adjustments and
+# game_adjust are the pending writes and _goal is derived from the score
+SERVER_ONLY = ('player_adjustments', 'game_adjust', '_goal')
+GAME_FIELDS = tuple(key for key in gamestate.GameState.CLIENT if key not in SERVER_ONLY)
+TURN_FIELDS = gamestate.TurnState.SAVED
+# game state fields that come from the player and the game rather than the
+# session. Other sessions and players change them without changing the
+# version, so a delta always has them
+EXTERNAL_FIELDS = tuple(key for key in GAME_FIELDS
+                        if key not in gamestate.GameState.SAVED and key != 'message')
+
+# (class, fields) -> compiled projection
+_projections = {}
+
+
+def compile_projection(cls, fields):
+    """get the function that projects an object of cls onto a dict of fields.
+       turn and turns of a game state are projected onto TURN_FIELDS
+    """
+    key = (cls, fields)
+    compiled = _projections.get(key)
+    if compiled is not None:
+        return compiled
+
+    get = operator.attrgetter(*fields)
+    if len(fields) == 1:
+        # attrgetter of one name returns the value rather than a tuple
+        get_one = get
+        get = lambda obj: (get_one(obj),)
+    project_turn = None
+    if cls is gamestate.GameState and ('turn' in fields or 'turns' in fields):
+        project_turn = compile_projection(gamestate.TurnState, TURN_FIELDS)
+
+    has_turn = project_turn is not None and 'turn' in fields
+    has_turns = project_turn is not None and 'turns' in fields
+
+    def project_fields(obj):
+        result = dict(zip(fields, get(obj)))
+        if has_turn:
+            result['turn'] = project_turn(obj.turn)
+        if has_turns:
+            result['turns'] = [project_turn(turn) for turn in obj.turns]
+        return result
+    _projections[key] = project_fields
+    return project_fields
+
+
+def mark_base(game_state):
+    """remember the fields of the game state as the client has them, so the
+       response is only what changes after
+    """
+    fields = tuple(key for key in GAME_FIELDS if key != 'turns')
+    base = compile_projection(gamestate.GameState, fields)(game_state)
+    # roll changes the dice in place
+    base['turn']['dice'] = list(base['turn']['dice'])
+    game_state._base = (base, list(game_state.turns))
+
+
+def delta(game_state, fields):
+    """the fields of the game state that changed since mark_base
+    """
+    base, base_turns = game_state._base
+    current = compile_projection(gamestate.GameState,
+                                 tuple(key for key in fields if key != 'turns'))(game_state)
+    changes = {}
+    for key, value in current.items():
+        if key == 'turn':
+            turn = {name: value[name] for name in TURN_FIELDS if value[name] != base['turn'][name]}
+            if len(turn) > 0:
+                changes['turn'] = turn
+        elif key in EXTERNAL_FIELDS or (key != 'version' and value != base[key]):
+            changes[key] = value
+    if 'turns' in fields:
+        # only the turns that are new are projected
+        project_turn = compile_projection(gamestate.TurnState, TURN_FIELDS)
+        num_base = len(base_turns)
+        if len(game_state.turns) >= num_base and \
+                all(turn is saved for turn, saved in zip(game_state.turns, base_turns)):
+            if len(game_state.turns) > num_base:
+                changes['turnsAdded'] = [project_turn(turn) for turn in game_state.turns[num_base:]]
+        else:
+            changes['turns'] = [project_turn(turn) for turn in game_state.turns]
+    return {'version': game_state.version, 'base': base['version'], 'changes': changes}
+
+
+def project(obj):
+    """the value to encode in a response. A game state is projected onto
+       GAME_FIELDS, or what changed in them since mark_base. Anything else is
+       returned as it is
+    """
+    if isinstance(obj, gamestate.GameState):
+        if obj._base is not None:
+            return delta(obj, GAME_FIELDS)
+        return compile_projection(gamestate.GameState, GAME_FIELDS)(obj)
+    return obj
@@ -1,5 +1,6 @@
 """This module computes the correct way to score the given dice
 """
+import itertools
 
 
 class Payout:
@@ -20,6 +21,7 @@ class ComboPoints:
     """
     DICESCORES = [0, 10, 2, 3, 4, 5, 6]
     DICEVALUE = [0, 100, 0, 0, 0, 50, 0]
+    __slots__ = ('dice', 'points', 'type', 'die')
 
     def __init__(self):
         #
@@ -133,23 +135,137 @@ class ComboPoints:
 
 
 
+# weight of each face in a count key. face f adds 7**(f-1), so the key of a
+# roll is its face counts written in base 7. index 0 is unused.
+FACE_KEY = [0] + [7 ** i for i in range(6)]
+
+
+class ScoreEntry:
+    """The precomputed score of one multiset of dice
+    """
+    __slots__ = ('total_points', 'used_faces', 'combos')
+
+    def __init__(self, total_points, used_faces, combos):
+        # total score
+        self.total_points = total_points
+        # bit (1 << face) is set if the dice showing that face are used
+        self.used_faces = used_faces
+        # (type, die, faces mask, points) for each combo, in evaluate order
+        self.combos = combos
+
+
+def count_key(rolled):
+    """get the table key for the dice, which only depends on the face counts
+    """
+    key = 0
+    for die in rolled:
+        key += FACE_KEY[die]
+    return key
+
+
+def build_score_table():
+    """Score every multiset of 0 to 6 dice with ScoreDice.evaluate and
+       return the results keyed by count_key
+    """
+    table = {}
+    for count in range(ScoreDice.SIDES + 1):
+        for rolled in itertools.combinations_with_replacement(range(1, 7), count):
+            score = ScoreDice(list(rolled), use_table=False)
+            combos = []
+            for combo in score.scores:
+                faces = 0
+                for idx in combo.dice:
+                    faces |= 1 << rolled[idx]
+                combos.append((combo.type, combo.die, faces, combo.points))
+            used_faces = 0
+            for idx, used in enumerate(score.dice_used):
+                if used:
+                    used_faces |= 1 << rolled[idx]
+            table[count_key(rolled)] = ScoreEntry(score.total_points, used_faces, tuple(combos))
+    return table
+
+
+def score_table():
+    """get the table of scores for every multiset of dice, building it on first use
+    """
+    if ScoreDice._table is None:
+        ScoreDice._table = build_score_table()
+    return ScoreDice._table
+
+
+def score_subsets(rolled):
+    """Score every subset of the rolled dice. Subset m holds the dice whose index
+       bit is set in m. Returns (points, legal) where points[m] is the score of
+       subset m and bit m of the integer legal is set if every die in subset m
+       is used in scoring. The empty subset is never legal.
+    """
+    table = score_table()
+    size = 1 << len(rolled)
+    keys = [0] * size
+    faces = [0] * size
+    points = [0] * size
+    legal = 0
+    for mask in range(1, size):
+        # extend the subset without its lowest die
+        low = mask & -mask
+        die = rolled[low.bit_length() - 1]
+        keys[mask] = keys[mask ^ low] + FACE_KEY[die]
+        faces[mask] = faces[mask ^ low] | (1 << die)
+        entry = table[keys[mask]]
+        points[mask] = entry.total_points
+        if faces[mask] & ~entry.used_faces == 0:
+            legal |= 1 << mask
+    return points, legal
+
+
 class ScoreDice:
     """Compute the score for the given dice
     """
     SIDES = 6
 
-    def __init__(self, rolled):
-        # array indicating which dice in rolled were actually used
-        self.dice_used = [False for i in rolled]
-        # total score
-        self.total_points = 0
-        # list of individual scores
-        self.scores = []
+    # scores of all 923 possible rolls, built on first use
+    _table = None
+
+    def __init__(self, rolled, use_table=True):
         # the dice that were selected
         self.rolled = rolled
+        # list of individual scores, created from the table entry when asked for
+        self._scores = None
+        self._entry = None
+
+        if use_table:
+            self._entry = score_table().get(count_key(rolled))
+
+        if self._entry is None:
+            # array indicating which dice in rolled were actually used
+            self.dice_used = [False for i in rolled]
+            # total score
+            self.total_points = 0
+            self.evaluate()
+            self.sum_points()
+        else:
+            used_faces = self._entry.used_faces
+            self.total_points = self._entry.total_points
+            self.dice_used = [(used_faces >> die) & 1 == 1 for die in rolled]
 
-        self.evaluate()
-        self.sum_points()
+    @property
+    def scores(self):
+        """list of individual scores as ComboPoints
+        """
+        if self._scores is None:
+            self._scores = []
+            for combo_type, die, faces, points in self._entry.combos:
+                score = ComboPoints()
+                score.type = combo_type
+                score.die = die
+                score.points = points
+                score.dice = [idx for idx, face in enumerate(self.rolled) if (faces >> face) & 1]
+                self._scores.append(score)
+        return self._scores
+
+    @scores.setter
+    def scores(self, value):
+        self._scores = value
 
 
     def sum_points(self):
@@ -240,3 +356,43 @@ class ScoreDice:
                         # all selected. But, better to keep original if the score was better
                         self.scores.clear()
                         self.scores.append(score)
+
+
+# numpy lookup arrays for score_batch, indexed by count key. built on first use
+_batch_points = None
+_batch_used = None
+
+
+def score_batch(rolls):
+    """Score many rolls at once. rolls is an integer array of shape (N, k) with
+       faces 1 to 6. A 0 marks an empty slot, so rolls with fewer dice can share
+       the array. Returns (points, used), where points has shape (N,) and used
+       is a boolean array of shape (N, k) marking the dice used in scoring.
+       Requires numpy, which is only needed for offline analysis.
+    """
+    global _batch_points, _batch_used
+    import numpy as np
+
+    if _batch_points is None:
+        size = 7 ** ScoreDice.SIDES
+        points = np.zeros(size, dtype=np.int64)
+        used = np.zeros((size, ScoreDice.SIDES + 1), dtype=bool)
+        for key, entry in score_table().items():
+            points[key] = entry.total_points
+            for face in range(1, ScoreDice.SIDES + 1):
+                used[key, face] = (entry.used_faces >> face) & 1 == 1
+        _batch_points, _batch_used = points, used
+
+    rolls = np.asarray(rolls, dtype=np.int64)
+    if rolls.ndim != 2 or rolls.shape[1] > ScoreDice.SIDES:
+        raise ValueError("rolls must have shape (N, k) with k <= 6")
+    if rolls.size and (rolls.min() < 0 or rolls.max() > ScoreDice.SIDES):
+        raise ValueError("dice faces must be between 1 and 6, or 0 for no die")
+
+    # face count histogram of each roll, then the base 7 count key
+    faces = np.arange(1, ScoreDice.SIDES + 1)
+    counts = (rolls[:, :, None] == faces).sum(axis=1)
+    keys = counts @ np.array(FACE_KEY[1:], dtype=np.int64)
+
+    # column 0 of the used table is always False, so empty slots are never used
+    return _batch_points[keys], _batch_used[keys[:, None], rolls]
@@ -0,0 +1,166 @@
+"""Compact binary encoding of a session, stored in the sessions table as one
+   Binary attribute instead of a map with every field name repeated per turn.
+
+   Layout of version 2, little endian:
+     game header: encoding version, flags, mode, tutorialStep, _goal, turnBet,
+                  won, wonGame, number of completed turns, state version
+     current turn, then each completed turn, as fixed width records:
+                  unboostedPoints, points, savePoints, diceRolled, freshRolls,
+                  flags, number of dice, dice packed two to a byte
+     if the mode is not one of MODES, its name as a length prefixed string
+   Version 1 is the same without the state version, which is read as 0.
+
+   The item keeps uniqID and player_id as plain attributes, since they are
+   the key and are read before the session is decoded, and the state version
+   too, so writes can expect the version they were loaded from. Items saved before
+   this encoding have no 'state' attribute and are read as maps; they are
+   rewritten in this encoding the next time they are saved.
+"""
+import struct
+import gamestate
+
+VERSION = 2
+# attribute of the session item holding the encoded state
+ATTRIBUTE = 'state'
+MODES = ('NORMAL', 'LONG', 'TUTORIAL')
+# mode byte for a mode that is not in MODES, whose name follows the turns
+_OTHER_MODE = 255
+
+# game header of each encoding version
+_GAMES = {
+    1: struct.Struct('<BBBBBiiiB'),
+    2: struct.Struct('<BBBBBiiiBI'),
+}
+_TURN = struct.Struct('<iiiBBBB3s')
+_GAME_FLAGS = ('boostBonus', 'gameOver', 'hasExtra', 'hasDoubled', 'hasUndone')
+_TURN_FLAGS = ('rolled', 'farkle', 'hasUndone', 'unfarkled', 'hasExtra', 'hasDoubled')
+_MAX_DICE = 6
+
+
+def _flags(obj, names):
+    bits = 0
+    for idx, name in enumerate(names):
+        if getattr(obj, name):
+            bits |= 1 << idx
+    return bits
+
+
+def _set_flags(obj, names, bits):
+    for idx, name in enumerate(names):
+        setattr(obj, name, (bits >> idx) & 1 == 1)
+
+
+def _pack_dice(dice):
+    """pack up to 6 dice of 1 to 6 into 3 bytes, two to a byte
+    """
+    if len(dice) > _MAX_DICE:
+        raise ValueError("too many dice: %r" % (dice,))
+    packed = bytearray(3)
+    for idx, die in enumerate(dice):
+        packed[idx >> 1] |= int(die) << (4 * (idx & 1))
+    return bytes(packed)
+
+
+def _unpack_dice(packed, count):
+    return [(packed[idx >> 1] >> (4 * (idx & 1))) & 0xf for idx in range(count)]
+
+
+def _encode_turn(turn):
+    return _TURN.pack(int(turn.unboostedPoints), int(turn.points), int(turn.savePoints),
+                      int(turn.diceRolled), int(turn.freshRolls),
+                      _flags(turn, _TURN_FLAGS), len(turn.dice), _pack_dice(turn.dice))
+
+
+def _decode_turn(data, offset):
+    unboosted, points, save_points, dice_rolled, fresh_rolls, flags, count, packed = \
+        _TURN.unpack_from(data, offset)
+    turn = gamestate.TurnState()
+    turn.unboostedPoints = unboosted
+    turn.points = points
+    turn.savePoints = save_points
+    turn.diceRolled = dice_rolled
+    turn.freshRolls = fresh_rolls
+    _set_flags(turn, _TURN_FLAGS, flags)
+    turn.dice = _unpack_dice(packed, count)
+    return turn
+
+
+def encode(game_state):
+    """encode the saved fields of the game state, except uniqID and player_id
+    """
+    mode = MODES.index(game_state.gameMode) if game_state.gameMode in MODES else _OTHER_MODE
+    parts = [_GAMES[VERSION].pack(VERSION, _flags(game_state, _GAME_FLAGS), mode,
+                                  int(game_state.tutorialStep), int(game_state._goal),
+                                  int(game_state.turnBet), int(game_state.won),
+                                  int(game_state.wonGame), len(game_state.turns),
+                                  int(game_state.version))]
+    parts.append(_encode_turn(game_state.turn))
+    parts.extend(_encode_turn(turn) for turn in game_state.turns)
+    if mode == _OTHER_MODE:
+        # the length is one byte, so longer names are cut short
+        name = str(game_state.gameMode).encode('utf-8')[:255]
+        parts.append(struct.pack('<B', len(name)) + name)
+    return b''.join(parts)
+
+
+def decode(data, game_state=None):
+    """decode data from encode into game_state, or a new GameState
+    """
+    if game_state is None:
+        game_state = gamestate.GameState()
+    data = bytes(data)
+    if len(data) == 0 or data[0] not in _GAMES:
+        raise ValueError("unknown session encoding %r" % data[:1])
+    header = _GAMES[data[0]]
+    values = header.unpack_from(data, 0)
+    _, flags, mode, tutorial_step, goal, turn_bet, won, won_game, num_turns = values[:9]
+    game_state.version = values[9] if len(values) > 9 else 0
+    _set_flags(game_state, _GAME_FLAGS, flags)
+    game_state.tutorialStep = tutorial_step
+    game_state._goal = goal
+    game_state.turnBet = turn_bet
+    game_state.won = won
+    game_state.wonGame = won_game
+    offset = header.size
+    game_state.turn = _decode_turn(data, offset)
+    offset += _TURN.size
+    turns = []
+    for _ in range(num_turns):
+        turns.append(_decode_turn(data, offset))
+        offset += _TURN.size
+    game_state.turns = turns
+    if mode == _OTHER_MODE:
+        length = data[offset]
+        name = data[offset + 1:offset + 1 + length]
+        game_state.gameMode = name.decode('utf-8', errors='ignore')
+    else:
+        game_state.gameMode = MODES[mode]
+    return game_state
+
+
+def encode_item(game_state):
+    """the sessions table item for the game state. The version is also kept
+       outside the encoded state, so writes can expect it
+    """
+    return {
+        'uniqID': game_state.uniqID,
+        'player_id': game_state.player_id,
+        'version': game_state.version,
+        ATTRIBUTE: encode(game_state),
+    }
+
+
+def is_encoded(item):
+    """True if the item was saved with encode_item, False for the older map form
+    """
+    return ATTRIBUTE in item
+
+
+def decode_item(item):
+    """the GameState of an item saved with encode_item
+    """
+    game_state = gamestate.GameState()
+    game_state.uniqID = item['uniqID']
+    game_state.player_id = item['player_id']
+    # boto3 reads binary attributes as Binary, which wraps the bytes
+    return decode(getattr(item[ATTRIBUTE], 'value', item[ATTRIBUTE]), game_state)
@@ -0,0 +1,549 @@
+"""Storage for the sessions, players, games and usernames tables. app.py only
+   talks to a Storage, so the handlers run the same on DynamoDB, in memory or
+   on a SQLite file.
+
+   Writes are dicts, so several can be done together:
+     {'table': 'players', 'put': item}
+     {'table': 'players', 'key': key, 'delete': True}
+     {'table': 'players', 'key': key, 'set': {path: value}, 'add': {path: number}}
+   Paths may be dotted to reach into maps, like 'farkle.amount_bet'. add treats
+   a missing value as 0. Any write can
+   also have 'expect': {path: (allowed values)}, where None allows the value to
+   be missing. If any expect does not hold, none of the writes happen.
+"""
+import base64
+import contextlib
+import copy
+import decimal
+import json
+import threading
+import time
+import metrics
+
+# primary key attribute of each table
+KEYS = {
+    'sessions': 'uniqID',
+    'players': 'player_id',
+    'games': 'gamename',
+    'usernames': 'username',
+}
+
+# connection settings. Requests go to several tables at once, and the
+# lambda times out after 10 seconds, so fail fast and retry
+DYNAMO_POOL_CONNECTIONS = 10
+DYNAMO_CONNECT_TIMEOUT = 1.0
+DYNAMO_READ_TIMEOUT = 2.0
+# the dynamodb resource and its tables, kept while the container is warm
+_dynamo = None
+_tables = {}
+
+
+class StorageError(Exception):
+    """A read or write failed in the storage behind it
+    """
+
+
+class ConditionFailed(StorageError):
+    """A conditional write failed. tables has the names of the tables whose
+       conditions failed
+    """
+    def __init__(self, tables):
+        super().__init__("condition failed on " + ', '.join(sorted(tables)))
+        self.tables = tables
+
+
+class Storage:
+    """The operations app.py needs. Backends implement get, write and
+       optionally get_many; the rest are built on those.
+    """
+    def get(self, table_name, key):
+        """get the item with the key dict, or None if there is none
+        """
+        raise NotImplementedError
+
+    def get_many(self, request_items, consistent=False):
+        """get items from several tables. request_items maps each table name to a
+           list of key dicts. Returns a dict of table name to the list of items
+           found. consistent asks for the latest writes where that matters
+        """
+        results = {}
+        for table_name, keys in request_items.items():
+            items = [self.get(table_name, key) for key in keys]
+            results[table_name] = [item for item in items if item is not None]
+        return results
+
+    def write(self, writes):
+        """do all the writes or none of them. Raises ConditionFailed if an
+           expect did not hold
+        """
+        raise NotImplementedError
+
+    def put(self, table_name, item, expect=None):
+        """replace the whole item
+        """
+        self.write([_with_expect({'table': table_name, 'put': item}, expect)])
+
+    def update(self, table_name, key, set_values=None, add=None, expect=None):
+        """change some of the values of the item, creating it if needed
+        """
+        write = {'table': table_name, 'key': key}
+        for name, values in (('set', set_values), ('add', add)):
+            if values:
+                write[name] = values
+        self.write([_with_expect(write, expect)])
+
+    def add(self, table_name, key, amounts):
+        """atomically add each of the amounts to the numbers at their paths
+        """
+        self.update(table_name, key, add=amounts)
+
+    def delete(self, table_name, key):
+        """remove the item
+        """
+        self.write([{'table': table_name, 'key': key, 'delete': True}])
+
+    def get_username(self, username, consistent=False):
+        """get the player_id that owns the username, or None
+        """
+        items = self.get_many({'usernames': [{'username': username}]}, consistent)['usernames']
+        return None if len(items) == 0 else items[0]['player_id']
+
+    def claim_username(self, username, player_id):
+        """give the username to the player. Returns False if another player has it
+        """
+        try:
+            self.put('usernames', {'username': username, 'player_id': player_id},
+                     {'username': (None,)})
+        except ConditionFailed:
+            return False
+        return True
+
+
+def _with_expect(write, expect):
+    if expect:
+        write['expect'] = expect
+    return write
+
+
+def write_key(write):
+    """get the key dict of the item a write changes
+    """
+    if 'put' in write:
+        key_name = KEYS[write['table']]
+        return {key_name: write['put'][key_name]}
+    return write['key']
+
+
+def get_path(item, path):
+    """get the value at a dotted path, or None if it is missing
+    """
+    for name in path.split('.'):
+        if not isinstance(item, dict) or name not in item:
+            return None
+        item = item[name]
+    return item
+
+
+def set_path(item, path, value):
+    """set the value at a dotted path, adding maps that are missing
+    """
+    names = path.split('.')
+    for name in names[:-1]:
+        item = item.setdefault(name, {})
+    item[names[-1]] = value
+
+
+def expect_holds(item, expect):
+    """True if the item has one of the allowed values at every expected path
+    """
+    for path, allowed in expect.items():
+        if get_path(item, path) not in allowed:
+            return False
+    return True
+
+
+def apply_write(item, write):
+    """get the item after the write, as a new object. None if it is deleted
+    """
+    if 'put' in write:
+        return copy.deepcopy(write['put'])
+    if write.get('delete'):
+        return None
+    item = copy.deepcopy(item) if item is not None else dict(write['key'])
+    for path, value in write.get('set', {}).items():
+        set_path(item, path, copy.deepcopy(value))
+    for path, value in write.get('add', {}).items():
+        set_path(item, path, (get_path(item, path) or 0) + value)
+    return item
+
+
+class LocalStorage(Storage):
+    """Storage kept by this process. Writes are applied by python under a
+       transaction, so subclasses only read and store whole items
+    """
+    def _transaction(self):
+        """context manager that makes the reads and stores inside it atomic
+        """
+        raise NotImplementedError
+
+    def _read(self, table_name, key_value):
+        """get the item, as an object the caller may change, or None
+        """
+        raise NotImplementedError
+
+    def _store(self, table_name, key_value, item):
+        """save the item, or remove it if item is None
+        """
+        raise NotImplementedError
+
+    def get(self, table_name, key):
+        start = time.perf_counter()
+        with self._transaction():
+            item = self._read(table_name, key[KEYS[table_name]])
+        metrics.storage_call('local.get', time.perf_counter() - start)
+        return item
+
+    def write(self, writes):
+        start = time.perf_counter()
+        try:
+            self._write(writes)
+        finally:
+            metrics.storage_call('local.write', time.perf_counter() - start)
+
+    def _write(self, writes):
+        with self._transaction():
+            # (table name, key) -> item after the writes so far
+            changed = {}
+            failed = set()
+            for write in writes:
+                table_name = write['table']
+                key_value = write_key(write)[KEYS[table_name]]
+                pending = (table_name, key_value)
+                item = changed[pending] if pending in changed else \
+                    self._read(table_name, key_value)
+                if 'expect' in write and not expect_holds(item, write['expect']):
+                    failed.add(table_name)
+                    continue
+                changed[pending] = apply_write(item, write)
+            if len(failed) > 0:
+                raise ConditionFailed(failed)
+            for (table_name, key_value), item in changed.items():
+                self._store(table_name, key_value, item)
+
+
+class MemoryStorage(LocalStorage):
+    """Tables in dicts, shared by the threads of one process. For tests and
+       load tests
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        # table name -> key value -> item
+        self._items = {table_name: {} for table_name in KEYS}
+
+    def _transaction(self):
+        return self._lock
+
+    def _read(self, table_name, key_value):
+        item = self._items[table_name].get(key_value)
+        # copied so callers can not change what is stored
+        return None if item is None else copy.deepcopy(item)
+
+    def _store(self, table_name, key_value, item):
+        if item is None:
+            self._items[table_name].pop(key_value, None)
+        else:
+            self._items[table_name][key_value] = item
+
+
+def _encode_value(value):
+    if isinstance(value, (bytes, bytearray)):
+        return {'__bytes__': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, decimal.Decimal):
+        integer = int(value)
+        return integer if integer == value else float(value)
+    raise TypeError("can not store %r" % type(value))
+
+
+def _decode_value(dct):
+    if '__bytes__' in dct and len(dct) == 1:
+        return base64.b64decode(dct['__bytes__'])
+    return dct
+
+
+class SQLiteStorage(LocalStorage):
+    """Tables in a SQLite file, one JSON document per item, so a local server
+       keeps its games between runs. Writes hold the database lock, so several
+       processes can share the file
+    """
+    def __init__(self, path=':memory:'):
+        import sqlite3
+
+        self.path = path
+        # transactions are started by hand, so they can take the write lock first
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS items ("
+                           "table_name TEXT NOT NULL, key TEXT NOT NULL, data TEXT NOT NULL, "
+                           "PRIMARY KEY (table_name, key))")
+        # one connection is shared by the threads of this process
+        self._lock = threading.RLock()
+        self._depth = 0
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._depth += 1
+            try:
+                if self._depth > 1:
+                    yield
+                    return
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    yield
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    raise
+                self._conn.execute("COMMIT")
+            finally:
+                self._depth -= 1
+
+    def _read(self, table_name, key_value):
+        row = self._conn.execute("SELECT data FROM items WHERE table_name = ? AND key = ?",
+                                 (table_name, str(key_value))).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0], object_hook=_decode_value)
+
+    def _store(self, table_name, key_value, item):
+        if item is None:
+            self._conn.execute("DELETE FROM items WHERE table_name = ? AND key = ?",
+                               (table_name, str(key_value)))
+        else:
+            self._conn.execute("INSERT OR REPLACE INTO items (table_name, key, data) "
+                               "VALUES (?, ?, ?)",
+                               (table_name, str(key_value), json.dumps(item, default=_encode_value)))
+
+    def close(self):
+        """close the database file
+        """
+        self._conn.close()
+
+
+def get_dynamo():
+    """get the dynamodb data connection. It is created once per container and
+       reused by warm invocations, so they keep the same HTTP connections
+    """
+    global _dynamo
+    if _dynamo is None:
+        # boto3 takes a long time to import, so only import it when it is used
+        import boto3
+        import botocore.config
+
+        _dynamo = boto3.resource('dynamodb', region_name='us-west-1', config=botocore.config.Config(
+            max_pool_connections=DYNAMO_POOL_CONNECTIONS,
+            connect_timeout=DYNAMO_CONNECT_TIMEOUT,
+            read_timeout=DYNAMO_READ_TIMEOUT,
+            retries={'max_attempts': 3, 'mode': 'standard'},
+            tcp_keepalive=True
+        ))
+    return _dynamo
+
+
+def get_table(db_conn, table_name):
+    """get the Table handle, reusing it for the connection from get_dynamo
+    """
+    if db_conn is not _dynamo:
+        return db_conn.Table(table_name)
+    table = _tables.get(table_name)
+    if table is None:
+        table = _tables[table_name] = db_conn.Table(table_name)
+    return table
+
+
+def dynamo_request(write):
+    """Convert a write to the DynamoDB operation name and its request, with
+       expressions for the changes and expects
+    """
+    request = {'TableName': write['table']}
+    if 'put' in write:
+        operation = 'Put'
+        request['Item'] = write['put']
+    elif write.get('delete'):
+        operation = 'Delete'
+        request['Key'] = write['key']
+    else:
+        operation = 'Update'
+        request['Key'] = write['key']
+    names = {}
+    values = {}
+
+    def name_of(path):
+        parts = []
+        for name in path.split('.'):
+            if name not in names:
+                names[name] = '#n' + str(len(names) + 1)
+            parts.append(names[name])
+        return '.'.join(parts)
+
+    def value_of(value):
+        placeholder = ':v' + str(len(values) + 1)
+        values[placeholder] = value
+        return placeholder
+
+    if operation == 'Update':
+        updates = []
+        for path, value in write.get('set', {}).items():
+            updates.append(name_of(path) + ' = ' + value_of(value))
+        for path, value in write.get('add', {}).items():
+            path_name = name_of(path)
+            values[':zero'] = 0
+            updates.append(path_name + ' = if_not_exists(' + path_name + ', :zero) + ' +
+                           value_of(value))
+        request['UpdateExpression'] = 'set ' + ', '.join(updates)
+
+    conditions = []
+    for path, allowed in write.get('expect', {}).items():
+        path_name = name_of(path)
+        tests = ['attribute_not_exists(' + path_name + ')' if value is None else \
+                 path_name + ' = ' + value_of(value) for value in allowed]
+        conditions.append('(' + ' OR '.join(tests) + ')')
+    if len(conditions) > 0:
+        request['ConditionExpression'] = ' AND '.join(conditions)
+
+    if len(names) > 0:
+        request['ExpressionAttributeNames'] = {alias: name for name, alias in names.items()}
+    if len(values) > 0:
+        request['ExpressionAttributeValues'] = values
+    return operation, request
+
+
+class DynamoStorage(Storage):
+    """The DynamoDB tables. The resource is only created on first use
+    """
+    def __init__(self, dynamo=None):
+        self._dynamo = dynamo
+        self._serializer = None
+
+    @property
+    def dynamo(self):
+        """the boto3 dynamodb resource
+        """
+        if self._dynamo is None:
+            self._dynamo = get_dynamo()
+        return self._dynamo
+
+    def get(self, table_name, key):
+        from botocore.exceptions import ClientError
+
+        start = time.perf_counter()
+        try:
+            response = get_table(self.dynamo, table_name).get_item(
+                Key=key, ReturnConsumedCapacity='TOTAL')
+        except ClientError as error:
+            raise StorageError(str(error)) from error
+        metrics.storage_call('dynamodb.GetItem', time.perf_counter() - start, 'read',
+                             response.get('ConsumedCapacity'))
+        return response.get('Item')
+
+    def get_many(self, request_items, consistent=False):
+        """get the items with BatchGetItem. Unprocessed keys are retried
+        """
+        from botocore.exceptions import ClientError
+
+        results = {table_name: [] for table_name in request_items}
+        pending = {table_name: {'Keys': keys, 'ConsistentRead': consistent} \
+                   for table_name, keys in request_items.items()}
+        attempt = 0
+        while len(pending) > 0:
+            if attempt > 0:
+                # unprocessed keys mean the table is throttling, so back off
+                time.sleep(min(0.05 * 2 ** attempt, 1.0))
+            start = time.perf_counter()
+            try:
+                response = self.dynamo.batch_get_item(RequestItems=pending,
+                                                      ReturnConsumedCapacity='TOTAL')
+            except ClientError as error:
+                raise StorageError(str(error)) from error
+            metrics.storage_call('dynamodb.BatchGetItem', time.perf_counter() - start, 'read',
+                                 response.get('ConsumedCapacity'))
+            for table_name, items in response['Responses'].items():
+                results[table_name].extend(items)
+            pending = response.get('UnprocessedKeys', {})
+            attempt += 1
+        return results
+
+    def serialize_item(self, item):
+        """convert a dict of python values to DynamoDB typed values for the low level client
+        """
+        if self._serializer is None:
+            from boto3.dynamodb.types import TypeSerializer
+
+            self._serializer = TypeSerializer()
+        return {key: self._serializer.serialize(value) for key, value in item.items()}
+
+    def write(self, writes):
+        """do the writes in one transaction, or as a plain put, update or
+           delete if there is one
+        """
+        from botocore.exceptions import ClientError
+
+        if len(writes) == 1:
+            # a single write does not need a transaction
+            operation, request = dynamo_request(writes[0])
+            table_name = request.pop('TableName')
+            table = get_table(self.dynamo, table_name)
+            request['ReturnConsumedCapacity'] = 'TOTAL'
+            start = time.perf_counter()
+            response = {}
+            try:
+                if operation == 'Put':
+                    response = table.put_item(**request)
+                elif operation == 'Delete':
+                    response = table.delete_item(**request)
+                else:
+                    response = table.update_item(**request)
+            except ClientError as error:
+                if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                    raise ConditionFailed({table_name}) from error
+                raise StorageError(str(error)) from error
+            finally:
+                metrics.storage_call('dynamodb.' + operation + 'Item', time.perf_counter() - start,
+                                     'write', response.get('ConsumedCapacity'))
+        elif len(writes) > 1:
+            items = []
+            for write in writes:
+                operation, request = dynamo_request(write)
+                for key in ('Item', 'Key', 'ExpressionAttributeValues'):
+                    if key in request:
+                        request[key] = self.serialize_item(request[key])
+                items.append({operation: request})
+            start = time.perf_counter()
+            response = {}
+            try:
+                response = self.dynamo.meta.client.transact_write_items(
+                    TransactItems=items, ReturnConsumedCapacity='TOTAL')
+            except ClientError as error:
+                if error.response['Error']['Code'] != 'TransactionCanceledException':
+                    raise StorageError(str(error)) from error
+                # the reasons are in the same order as the writes
+                reasons = error.response.get('CancellationReasons', [])
+                failed = {writes[idx]['table'] for idx, reason in enumerate(reasons) \
+                          if reason.get('Code') == 'ConditionalCheckFailed'}
+                if len(failed) == 0:
+                    raise StorageError(str(error)) from error
+                raise ConditionFailed(failed) from error
+            finally:
+                metrics.storage_call('dynamodb.TransactWriteItems', time.perf_counter() - start,
+                                     'write', response.get('ConsumedCapacity'))
+
+
+def open_storage(spec):
+    """Create the storage named by spec: 'dynamodb', 'memory' or 'sqlite:<path>'
+    """
+    if spec == 'dynamodb':
+        return DynamoStorage()
+    if spec == 'memory':
+        return MemoryStorage()
+    if spec.startswith('sqlite:'):
+        return SQLiteStorage(spec[len('sqlite:'):])
+    raise ValueError("unknown storage: " + spec)
@@ -0,0 +1,52 @@
+import json
+import os
+import sys
+
+import pytest
+
+# the lambda code imports its modules flat from the farkle folder, and the
+# offline tools are in the tools folder
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'farkle'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'tools'))
+
+# pylint: disable=wrong-import-position
+import app
+import storage
+
+
+@pytest.fixture()
+def memory_storage():
+    """memory storage used by app while the test runs"""
+    db_conn = storage.MemoryStorage()
+    app.set_storage(db_conn)
+    yield db_conn
+    app.set_storage(None)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request):
+    """each local storage in turn, used by app while the test runs"""
+    if request.param == 'memory':
+        db_conn = storage.MemoryStorage()
+    else:
+        db_conn = storage.SQLiteStorage()
+    app.set_storage(db_conn)
+    yield db_conn
+    app.set_storage(None)
+
+
+def call_command(command, **data):
+    """send the command to shared_handler. Returns the status code and the
+       decoded body
+    """
+    response = app.shared_handler({
+        'pathParameters': {'command': command},
+        'body': json.dumps(data)
+    }, None)
+    return response['statusCode'], json.loads(response['body'])
+
+
+@pytest.fixture()
+def call():
+    """call_command, for tests that drive the handler"""
+    return call_command
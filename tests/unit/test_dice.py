@@ -0,0 +1,74 @@
+import random
+
+import pytest
+
+import dice
+import gamestate
+
+# chi-square critical value for 5 degrees of freedom at p = 0.001
+CHI2_5DF = 20.515
+
+SCREWS = [0.5, 1.0, 1.4, 2.5, 3.0]
+
+
+def face_counts(faces):
+    counts = [0] * 7
+    for face in faces:
+        counts[face] += 1
+    return counts[1:]
+
+
+def chi_square(counts, probabilities):
+    total = sum(counts)
+    return sum((count - total * prob) ** 2 / (total * prob)
+               for count, prob in zip(counts, probabilities[1:]))
+
+
+def test_face_probabilities():
+    assert dice.face_probabilities(1.0)[1:] == pytest.approx([1 / 6] * 6)
+    probs = dice.face_probabilities(3.0)
+    assert probs[1] == pytest.approx(0.5)
+    assert probs[2:] == pytest.approx([0.1] * 5)
+    assert dice.face_probabilities(9.0)[1:] == [1.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+
+
+@pytest.mark.parametrize('screws', SCREWS)
+def test_rand_matches_face_probabilities(screws):
+    random.seed(screws)
+    turn = gamestate.TurnState()
+    counts = face_counts(turn.rand(screws) for _ in range(60000))
+    assert chi_square(counts, dice.face_probabilities(screws)) < CHI2_5DF
+
+
+@pytest.mark.parametrize('screws', SCREWS)
+def test_roll_matches_rand(screws):
+    random.seed(screws)
+    die = dice.weighted_die(screws)
+    counts = face_counts(die.roll(60000))
+    assert chi_square(counts, dice.face_probabilities(screws)) < CHI2_5DF
+
+    # two sample test against TurnState.rand, so both share one distribution
+    turn = gamestate.TurnState()
+    rand_counts = face_counts(turn.rand(screws) for _ in range(60000))
+    stat = 0.0
+    for count, rand_count in zip(counts, rand_counts):
+        expected = (count + rand_count) / 2
+        stat += (count - expected) ** 2 / expected + (rand_count - expected) ** 2 / expected
+    assert stat < CHI2_5DF
+
+
+@pytest.mark.parametrize('screws', SCREWS)
+def test_roll_batch(screws):
+    np = pytest.importorskip('numpy')
+    rolls = dice.weighted_die(screws).roll_batch(20000, 6, np.random.default_rng(7))
+    assert rolls.shape == (20000, 6)
+    counts = np.bincount(rolls.ravel(), minlength=7)[1:].tolist()
+    assert chi_square(counts, dice.face_probabilities(screws)) < CHI2_5DF
+
+
+def test_turn_roll():
+    turn = gamestate.TurnState()
+    turn.diceRolled = 4
+    turn.roll(9.0)
+    assert turn.dice == [1, 1, 1, 1]
+    assert turn.roll_points() == 2000
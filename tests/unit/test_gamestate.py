@@ -0,0 +1,87 @@
+import gamestate
+
+
+def rolled_turn(dice):
+    turn = gamestate.TurnState()
+    turn.dice = dice
+    turn.diceRolled = len(dice)
+    turn.rolled = True
+    turn.score_holds()
+    return turn
+
+
+def test_hold_points():
+    turn = rolled_turn([1, 5, 2, 2, 2, 6])
+    assert turn.roll_points() == 350
+    assert turn.hold_points([0]) == 100
+    assert turn.hold_points([0, 1]) == 150
+    assert turn.hold_points([2, 3, 4]) == 200
+    assert turn.hold_points([5]) == -1
+    assert turn.hold_points([0, 0]) == -1
+    assert turn.hold_points([6]) == -1
+
+
+def test_hold_cache_not_saved():
+    turn = rolled_turn([3, 3, 3])
+    assert '_holdPoints' not in turn.get_save_dict()
+    loaded = gamestate.TurnState()
+    loaded.init_dict(turn.get_save_dict())
+    assert loaded.hold_points([0, 1, 2]) == 300
+
+
+def test_end_roll_uses_hold():
+    game = gamestate.GameState()
+    game.turn = rolled_turn([1, 5, 2, 2, 2, 6])
+    assert not game.end_roll([0, 5])
+    assert game.message == "invalid dice held"
+    assert game.end_roll([0, 2, 3, 4])
+    assert game.turn.points == 300
+    assert game.turn.diceRolled == 2
+
+
+def test_unknown_fields_ignored():
+    game = gamestate.GameState()
+    game.init_dict({'uniqID': 'abc', 'gameMode': 'LONG', 'balance': 5, 'stray': 1})
+    assert game.uniqID == 'abc'
+    assert game.gameMode == 'LONG'
+    # balance comes from the player, not the session
+    assert game.balance == 0
+    assert not hasattr(game, 'stray')
+    assert set(game.get_save_dict()) == set(gamestate.GameState.SAVED)
+
+    turn = gamestate.TurnState()
+    turn.init_dict({'points': 300, 'stray': 1})
+    assert turn.points == 300
+    assert set(turn.get_save_dict()) == set(gamestate.TurnState.SAVED)
+
+
+def test_client_dict_has_no_tracking():
+    game = gamestate.GameState()
+    game.mark_saved()
+    client = game.get_client_dict()
+    assert set(client) == set(gamestate.GameState.CLIENT)
+    assert '_saved' not in client
+    assert 'playerVersion' not in client
+
+
+def test_has_changes():
+    game = gamestate.GameState()
+    assert game.has_changes()
+    game.turns.append(rolled_turn([1, 1, 1]))
+    game.turn = rolled_turn([2, 3])
+    game.mark_saved()
+    assert not game.has_changes()
+
+    # roll changes the dice in place
+    game.turn.dice[0] = 5
+    assert game.has_changes()
+    game.mark_saved()
+    game.won = 100
+    assert game.has_changes()
+    game.mark_saved()
+
+    game.turns.append(game.turn)
+    assert game.has_changes()
+    game.mark_saved()
+    game.turns = [gamestate.TurnState() for _ in game.turns]
+    assert game.has_changes()
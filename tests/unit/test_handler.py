@@ -1,8 +1,10 @@
+import concurrent.futures
+import decimal
 import json
 
 import pytest
 
-from farkle import app
+import app
 
 
 @pytest.fixture()
@@ -10,7 +12,7 @@ def apigw_event():
     """ Generates API GW Event"""
 
     return {
-        "body": '{ "player_id": "1"}',
+        "body": '{ "username": "bob", "password": "secret", "displayname": "Bob"}',
         "resource": "/{proxy+}",
         "requestContext": {
             "resourceId": "123456",
@@ -55,19 +57,80 @@ def apigw_event():
             "CloudFront-Forwarded-Proto": "https",
             "Accept-Encoding": "gzip, deflate, sdch",
         },
-        "pathParameters": {"proxy": "/examplepath"},
+        "pathParameters": {"command": "login"},
         "httpMethod": "POST",
         "stageVariables": {"baz": "qux"},
-        "path": "/examplepath",
+        "path": "/farkle/login",
     }
 
 
-def test_lambda_handler(apigw_event, mocker):
+def test_shared_handler(apigw_event, memory_storage):
 
-    ret = app.lambda_handler(apigw_event, "")
+    ret = app.shared_handler(apigw_event, "")
     data = json.loads(ret["body"])
 
     assert ret["statusCode"] == 200
-    assert "message" in ret["body"]
-    assert data["message"] == "hello world"
-    # assert "location" in data.dict_keys()
+    assert ret["headers"]["Content-Type"] == "application/json"
+    assert data["balance"] == 100000
+    assert memory_storage.get_username("bob") == data["player_id"]
+
+
+def test_unknown_command(apigw_event, memory_storage):
+    apigw_event["pathParameters"]["command"] = "examplepath"
+
+    ret = app.shared_handler(apigw_event, "")
+    data = json.loads(ret["body"])
+
+    assert ret["statusCode"] == 502
+    assert data["message"] == "unknown command"
+
+
+def test_anonymous_start(apigw_event, memory_storage):
+    apigw_event["pathParameters"]["command"] = "start"
+    apigw_event["body"] = json.dumps({"player_id": "", "bet": 500})
+
+    ret = app.shared_handler(apigw_event, "")
+    data = json.loads(ret["body"])
+
+    assert ret["statusCode"] == 200
+    assert data["player_id"] != ""
+    assert data["turnBet"] == 500
+    saved = memory_storage.get("sessions", {"uniqID": data["uniqID"]})
+    assert saved["player_id"] == data["player_id"]
+
+
+def test_from_item():
+    item = {
+        'uniqID': 's1',
+        'turnBet': decimal.Decimal('500'),
+        'turn': {'diceRolled': decimal.Decimal('2'), 'dice': [decimal.Decimal('1'),
+                                                              decimal.Decimal('5')]},
+        'turns': [{'diceRolled': decimal.Decimal('0'), 'points': decimal.Decimal('350')}],
+        'game_adjust': {'odds': {'jackpot': decimal.Decimal('0.25')},
+                        'history': [decimal.Decimal('1.5'), 'x', [decimal.Decimal('3')]]},
+    }
+    game_state = app.from_item(item)
+    assert game_state.turnBet == 500 and type(game_state.turnBet) is int
+    assert game_state.turn.dice == [1, 5] and type(game_state.turn.dice[0]) is int
+    assert game_state.turns[0].points == 350
+    # maps that are not sessions or turns stay dicts, with their numbers converted
+    assert app.from_item(item['game_adjust']) == {'odds': {'jackpot': 0.25},
+                                                  'history': [1.5, 'x', [3]]}
+    assert app.from_item(decimal.Decimal('-7')) == -7
+    assert app.from_item('text') == 'text'
+
+
+def test_cache_shared_by_threads():
+    cache = app.TTLCache(8, 60.0)
+
+    def churn(offset):
+        for idx in range(5000):
+            key = (idx + offset) % 16
+            cache.put(key, idx)
+            cache.get((key + 1) % 16)
+            cache.invalidate((key + 2) % 16)
+
+    with concurrent.futures.ThreadPoolExecutor(8) as pool:
+        for future in [pool.submit(churn, offset) for offset in range(8)]:
+            future.result()
+    assert len(cache._items) <= 8
@@ -0,0 +1,129 @@
+import random
+
+import pytest
+
+import app
+import gamestate
+import storage
+
+
+class RacingStorage(storage.MemoryStorage):
+    """another player adds to a jackpot shard right after each of the first
+    `races` consistent reads"""
+    def __init__(self, races):
+        super().__init__()
+        self.races = races
+        self.claim_reads = 0
+
+    def get_many(self, request_items, consistent=False):
+        items = super().get_many(request_items, consistent)
+        if consistent and 'games' in request_items:
+            self.claim_reads += 1
+            if self.claim_reads <= self.races:
+                self.add('games', {'gamename': 'farkle#3'}, {'jackpot': 10})
+        return items
+
+
+def shards(db_conn):
+    items = db_conn.get_many({'games': app.jackpot_keys()})['games']
+    return [item.get('jackpot', 0) for item in items]
+
+
+def fill_jackpot(db_conn, amounts):
+    for key, amount in zip(app.jackpot_keys(), amounts):
+        db_conn.put('games', dict(key, jackpot=amount))
+
+
+def claiming_game(db_conn, claimed, increment=0):
+    """a game state that just won the jackpot it loaded as claimed"""
+    db_conn.put('players', {'player_id': 'p1', 'num_credits': 1000, 'version': 1})
+    game_state = gamestate.GameState()
+    game_state.player_id = 'p1'
+    game_state.game_adjust['jackpot_claim'] = claimed
+    if increment != 0:
+        game_state.game_adjust['jackpot'] = increment
+    game_state.player_adjustments['num_credits'] = claimed
+    game_state.balance = 1000 + claimed
+    return game_state
+
+
+def test_increments_are_spread(store):
+    random.seed(3)
+    for _ in range(40):
+        game_state = gamestate.GameState()
+        game_state.player_id = 'p1'
+        game_state.game_adjust['jackpot'] = 50
+        app.update_gamestate(store, game_state)
+    amounts = shards(store)
+    assert sum(amounts) == 40 * 50
+    assert sum(1 for amount in amounts if amount > 0) > app.JACKPOT_SHARDS // 2
+
+
+def test_claim_drains_every_shard(store):
+    fill_jackpot(store, [5000, 100, 0, 250, 0, 0, 50, 0])
+    game_state = claiming_game(store, 5000, increment=50)
+    app.update_gamestate(store, game_state)
+
+    assert shards(store) == [gamestate.GameState.JACKPOT_RESET + 50] + [0] * 7
+    # the player is paid what was in the shards, not what was loaded
+    assert store.get('players', {'player_id': 'p1'})['num_credits'] == 1000 + 5400
+    assert game_state.balance == 1000 + 5400
+    assert game_state.jackpot == gamestate.GameState.JACKPOT_RESET + 50
+
+
+def test_claim_retries_when_a_shard_changes():
+    db_conn = RacingStorage(races=2)
+    app.set_storage(db_conn)
+    try:
+        fill_jackpot(db_conn, [5000, 100])
+        app.update_gamestate(db_conn, claiming_game(db_conn, 5100))
+    finally:
+        app.set_storage(None)
+    assert db_conn.claim_reads == 3
+    assert shards(db_conn) == [gamestate.GameState.JACKPOT_RESET] + [0] * 7
+    assert db_conn.get('players', {'player_id': 'p1'})['num_credits'] == 1000 + 5100 + 20
+
+
+def test_claim_gives_up():
+    db_conn = RacingStorage(races=app.JACKPOT_CLAIM_ATTEMPTS)
+    app.set_storage(db_conn)
+    try:
+        fill_jackpot(db_conn, [5000])
+        with pytest.raises(storage.ConditionFailed):
+            app.update_gamestate(db_conn, claiming_game(db_conn, 5000))
+    finally:
+        app.set_storage(None)
+    assert db_conn.claim_reads == app.JACKPOT_CLAIM_ATTEMPTS
+    # nothing was paid and the jackpot only has what the others added
+    assert db_conn.get('players', {'player_id': 'p1'})['num_credits'] == 1000
+    assert sum(shards(db_conn)) == 5000 + 10 * app.JACKPOT_CLAIM_ATTEMPTS
+
+
+def test_winner_gets_an_error_response(monkeypatch, call):
+    sleeps = []
+    monkeypatch.setattr(app.time, 'sleep', sleeps.append)
+    db_conn = RacingStorage(races=100)
+    app.set_storage(db_conn)
+    try:
+        code, login = call('login', username='bob', password='secret', displayname='Bob')
+        code, game = call('start', player_id=login['player_id'], bet=500)
+        # a turn that wins the jackpot when three ones are held
+        game_state = app.load_gamestate(db_conn, game['uniqID'], login['player_id'])
+        game_state.turn.dice = [1, 1, 1, 2, 3, 4]
+        game_state.turn.rolled = True
+        game_state.turn.points = 10000
+        game_state.version += 1
+        app.update_gamestate(db_conn, game_state)
+
+        code, body = call('stop', session=game['uniqID'], player_id=login['player_id'],
+                          hold=[0, 1, 2])
+    finally:
+        app.set_storage(None)
+    assert code == 502
+    assert 'try again' in body['message']
+    # every claim conflicted, with a longer wait before each next one
+    assert len(sleeps) == app.JACKPOT_CLAIM_ATTEMPTS - 1
+    for attempt, seconds in enumerate(sleeps):
+        assert 0 <= seconds <= app.JACKPOT_CLAIM_BACKOFF * 2 ** attempt
+    assert db_conn.get('players', {'player_id': login['player_id']})['num_credits'] == \
+        login['balance'] - 500
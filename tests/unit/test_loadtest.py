@@ -0,0 +1,19 @@
+import loadtest
+
+
+def test_percentile():
+    values = [0.001 * idx for idx in range(1, 101)]
+    assert loadtest.percentile(values, 50) == values[49]
+    assert loadtest.percentile(values, 99) == values[98]
+    assert loadtest.percentile([0.5], 95) == 0.5
+    assert loadtest.percentile([], 95) == 0.0
+
+
+def test_run_load():
+    stats = loadtest.run_load(players=6, games=2, concurrency=3, long_share=0.5, seed=7)
+    assert stats.games == 12
+    assert sum(stats.errors.values()) == 0
+    assert len(stats.latencies['login']) == 6
+    assert len(stats.latencies['start']) >= 12
+    assert len(stats.latencies['stop']) == len(stats.latencies['start'])
+    assert 'p99 ms' in stats.report()
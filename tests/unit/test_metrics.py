@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+import app
+import metrics
+import storage
+
+
+@pytest.fixture()
+def enabled(monkeypatch, memory_storage):
+    monkeypatch.setattr(metrics, 'ENABLED', True)
+
+
+class FakeTable:
+    def get_item(self, **kwargs):
+        assert kwargs['ReturnConsumedCapacity'] == 'TOTAL'
+        return {
+            'Item': {'player_id': 'p1'},
+            'ConsumedCapacity': {'TableName': 'players', 'CapacityUnits': 0.5}
+        }
+
+
+class FakeDynamo:
+    def Table(self, table_name):
+        return FakeTable()
+
+
+def test_disabled_records_nothing(monkeypatch):
+    monkeypatch.setattr(metrics, 'ENABLED', False)
+    metrics.start('roll')
+    with metrics.timer('game'):
+        pass
+    assert metrics.current() is None
+    assert metrics.finish(200) is None
+
+
+def test_capacity():
+    invocation = metrics.Invocation('roll')
+    invocation.add_capacity('read', [{'TableName': 'sessions', 'CapacityUnits': 0.5},
+                                     {'TableName': 'players', 'CapacityUnits': 1.0}])
+    invocation.add_capacity('write', {'TableName': 'sessions', 'CapacityUnits': 2.0})
+    assert invocation.capacity == {'read': 1.5, 'write': 2.0}
+    assert invocation.table_capacity == {'sessions': 2.5, 'players': 1.0}
+
+
+def test_dynamo_capacity(enabled, capsys):
+    metrics.start('login')
+    db_conn = storage.DynamoStorage(FakeDynamo())
+    assert db_conn.get('players', {'player_id': 'p1'}) == {'player_id': 'p1'}
+    record = metrics.finish(200)
+    assert record['storage_calls'] == 1
+    assert record['read_capacity'] == 0.5
+    assert 'dynamodb.GetItem' in record
+    assert json.loads(capsys.readouterr().out) == record
+
+
+def test_handler_emits_one_line(enabled, capsys):
+    response = app.shared_handler({
+        'pathParameters': {'command': 'login'},
+        'body': json.dumps({'username': 'bob', 'password': 'secret', 'displayname': 'Bob'})
+    }, None)
+    assert response['statusCode'] == 200
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 1
+    record = json.loads(lines[0])
+    assert record['command'] == 'login'
+    assert record['status'] == 200
+    names = [metric['Name'] for metric in record['_aws']['CloudWatchMetrics'][0]['Metrics']]
+    for name in ('duration', 'parse', 'format', 'local.get', 'local.write'):
+        assert name in names
+        assert record[name] >= 0
+
+
+def test_unknown_command_is_grouped(enabled, capsys):
+    app.shared_handler({'pathParameters': {'command': 'nope'}, 'body': '{}'}, None)
+    record = json.loads(capsys.readouterr().out)
+    assert record['command'] == 'unknown'
+    assert record['status'] == 502
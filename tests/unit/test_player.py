@@ -0,0 +1,21 @@
+import player
+
+
+def test_save_and_load():
+    player_1 = player.Player()
+    player_1.farkle['games_played'] = 4
+    item = player_1.get_save_dict()
+    item['stray'] = 'ignored'
+    loaded = player.Player()
+    loaded.init_dict(item)
+    assert loaded.get_save_dict() == player_1.get_save_dict()
+    assert not hasattr(loaded, 'stray')
+
+
+def test_client_dict():
+    player_1 = player.Player()
+    player_1.farkle['num_farkle_boosts'] = 7
+    client = player_1.get_client_dict()
+    assert client['numBoosts'] == 7
+    assert client['balance'] == player_1.num_credits
+    assert 'password' not in client
@@ -0,0 +1,46 @@
+import json
+
+import app
+import request_profiling
+
+
+def login_event(headers=None):
+    return {
+        'pathParameters': {'command': 'login'},
+        'headers': headers,
+        'body': json.dumps({'username': 'bob', 'password': 'secret', 'displayname': 'Bob'})
+    }
+
+
+def test_should_profile(monkeypatch):
+    monkeypatch.setattr(request_profiling, 'RATE', 0.0)
+    monkeypatch.setattr(request_profiling, 'TOKEN', 'sesame')
+    assert request_profiling.should_profile(login_event({'X-Farkle-Profile': 'sesame'}))
+    assert not request_profiling.should_profile(login_event({'X-Farkle-Profile': 'guess'}))
+    assert not request_profiling.should_profile(login_event())
+    monkeypatch.setattr(request_profiling, 'TOKEN', '')
+    assert not request_profiling.should_profile(login_event({'X-Farkle-Profile': ''}))
+    monkeypatch.setattr(request_profiling, 'RATE', 1.0)
+    assert request_profiling.should_profile(login_event())
+
+
+def test_profile_to_log(monkeypatch, memory_storage, capsys):
+    monkeypatch.setattr(request_profiling, 'ENABLED', True)
+    monkeypatch.setattr(request_profiling, 'TOKEN', 'sesame')
+    monkeypatch.setattr(request_profiling, 'OUTPUT_DIR', '')
+    monkeypatch.setattr(request_profiling, 'TOP', 5)
+    response = app.shared_handler(login_event({'x-farkle-profile': 'sesame'}), None)
+    assert response['statusCode'] == 200
+    result = json.loads(capsys.readouterr().out)
+    assert result['profile'] == 'login'
+    assert any('login_handler' in line for line in result['hotspots'])
+    assert 0 < len(result['allocations']) <= 5
+    assert result['peak_memory'] > 0
+
+
+def test_profile_to_folder(monkeypatch, tmp_path, capsys):
+    monkeypatch.setattr(request_profiling, 'OUTPUT_DIR', str(tmp_path))
+    assert request_profiling.profile('sum', sum, [1, 2, 3]) == 6
+    assert capsys.readouterr().out == ''
+    names = sorted(path.suffix for path in tmp_path.iterdir())
+    assert names == ['.json', '.prof']
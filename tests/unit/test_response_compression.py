@@ -0,0 +1,75 @@
+import base64
+import gzip
+import json
+import zlib
+
+import pytest
+
+import app
+import response_compression
+import metrics
+
+
+def big_response():
+    return app.format_response({'turns': [{'points': idx, 'dice': [1, 5]} for idx in range(100)]})
+
+
+def test_choose_encoding():
+    assert response_compression.choose_encoding('gzip, deflate, br') == 'gzip'
+    assert response_compression.choose_encoding('deflate, gzip;q=0.5') == 'deflate'
+    assert response_compression.choose_encoding('gzip;q=0, deflate;q=0.1') == 'deflate'
+    assert response_compression.choose_encoding('br, *;q=0.2') == 'gzip'
+    assert response_compression.choose_encoding('*, gzip;q=0, deflate;q=0') is None
+    assert response_compression.choose_encoding('identity') is None
+    assert response_compression.choose_encoding(None) is None
+
+
+@pytest.mark.parametrize('encoding,decompress', [
+    ('gzip', gzip.decompress),
+    ('deflate', zlib.decompress),
+])
+def test_compressed(monkeypatch, encoding, decompress):
+    monkeypatch.setattr(metrics, 'ENABLED', True)
+    response = big_response()
+    metrics.start('roll')
+    compressed = response_compression.compress_response(response, {'Accept-Encoding': encoding})
+    record = metrics.finish(200)
+
+    assert compressed['isBase64Encoded']
+    assert compressed['headers']['Content-Encoding'] == encoding
+    assert compressed['headers']['Content-Type'] == 'application/json'
+    assert compressed['headers']['Vary'] == 'Accept-Encoding'
+    data = base64.b64decode(compressed['body'])
+    assert decompress(data).decode('utf-8') == response['body']
+    assert record['response_bytes'] == len(response['body'])
+    assert record['bytes_saved'] == len(response['body']) - len(data)
+    assert 'Content-Encoding' not in response['headers']
+
+
+def test_not_compressed():
+    small = app.format_response({'message': 'no'})
+    response = big_response()
+    for original, headers in ((small, {'accept-encoding': 'gzip'}),
+                              (response, {'Accept-Encoding': 'br'}),
+                              (response, None)):
+        result = response_compression.compress_response(original, headers)
+        assert result['body'] == original['body']
+        assert not result.get('isBase64Encoded')
+        assert 'Content-Encoding' not in result['headers']
+        # caches must not serve it to a client that accepts another coding
+        assert result['headers']['Vary'] == 'Accept-Encoding'
+        assert 'Vary' not in original['headers']
+
+
+def test_handler(monkeypatch, memory_storage):
+    monkeypatch.setattr(response_compression, 'MIN_BYTES', 0)
+    body = json.dumps({'username': 'bob', 'password': 'secret', 'displayname': 'Bob'})
+    response = app.shared_handler({
+        'pathParameters': {'command': 'login'},
+        'headers': {'Accept-Encoding': 'gzip'},
+        'isBase64Encoded': True,
+        'body': base64.b64encode(body.encode('utf-8')).decode('ascii'),
+    }, None)
+    assert response['statusCode'] == 200
+    data = json.loads(gzip.decompress(base64.b64decode(response['body'])))
+    assert data['username'] == 'bob'
@@ -0,0 +1,93 @@
+import json
+
+import app
+import gamestate
+import responses
+
+
+def test_projection():
+    game = gamestate.GameState()
+    game.turn.dice = [1, 5]
+    game.turns.append(gamestate.TurnState())
+    game.player_adjustments['num_credits'] = -500
+    game.game_adjust['jackpot'] = 50
+
+    body = json.loads(app.format_response(game)['body'])
+    assert set(body) == set(responses.GAME_FIELDS)
+    for key in responses.SERVER_ONLY:
+        assert key not in body
+    assert body['turn'] == game.turn.get_save_dict()
+    assert body['turns'] == [turn.get_save_dict() for turn in game.turns]
+
+
+def test_compiled_once():
+    first = responses.compile_projection(gamestate.TurnState, ('points',))
+    assert responses.compile_projection(gamestate.TurnState, ('points',)) is first
+    assert first(gamestate.TurnState()) == {'points': 0}
+
+
+def test_other_values_are_unchanged():
+    assert json.loads(app.format_response({'message': 'no'})['body']) == {'message': 'no'}
+    assert app.format_response(None, None, 502)['body'] == 'null'
+
+
+def test_delta():
+    game = gamestate.GameState()
+    game.turns.append(gamestate.TurnState())
+    game.version = 4
+    responses.mark_base(game)
+    game.turn.dice.extend([2, 2])
+    game.turns.append(game.turn)
+    game.message = 'rolled'
+    game.version = 5
+
+    body = json.loads(app.format_response(game)['body'])
+    assert body['version'] == 5
+    assert body['base'] == 4
+    external = {key: getattr(game, key) for key in responses.EXTERNAL_FIELDS}
+    assert body['changes'] == dict(external, **{
+        'message': 'rolled',
+        'turn': {'dice': [2, 2]},
+        'turnsAdded': [game.turn.get_save_dict()],
+    })
+
+
+def test_delta_only_for_current_version(memory_storage, call):
+    code, login = call('login', username='bob', password='secret', displayname='Bob')
+    code, game = call('start', player_id=login['player_id'], bet=500)
+    assert game['version'] == 1
+    code, patch = call('roll', session=game['uniqID'], player_id=login['player_id'],
+                       version=1)
+    assert code == 200
+    assert patch['version'] == 2
+    assert patch['base'] == 1
+    assert patch['changes']['turn']['rolled']
+    assert 'gameMode' not in patch['changes']
+
+    # the client missed a version, so it gets all of it
+    code, full = call('roll', session=game['uniqID'], player_id=login['player_id'],
+                      version=1)
+    assert 'changes' not in full
+    assert full['version'] >= patch['version']
+    assert full['gameMode'] == 'NORMAL'
+
+
+def test_delta_has_changes_of_other_writers(memory_storage, call):
+    code, login = call('login', username='bob', password='secret', displayname='Bob')
+    code, game = call('start', player_id=login['player_id'], bet=500)
+    # another player adds to the jackpot and the player is paid in another
+    # session, neither of which changes the version of this session
+    key = {'player_id': login['player_id']}
+    memory_storage.add('players', key, {'num_credits': 1000, 'version': 1})
+    memory_storage.add('games', app.jackpot_keys()[0], {'jackpot': 7000})
+    app._game_cache.clear()
+
+    code, patch = call('roll', session=game['uniqID'], player_id=login['player_id'],
+                       version=game['version'])
+    assert code == 200
+    assert patch['base'] == game['version']
+    changes = patch['changes']
+    assert changes['jackpot'] == game['jackpot'] + 7000
+    assert changes['balance'] == game['balance'] + 1000
+    assert changes['balance'] == memory_storage.get('players', key)['num_credits']
+    assert changes['numGems'] == game['numGems']
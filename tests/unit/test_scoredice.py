@@ -0,0 +1,68 @@
+import itertools
+
+import pytest
+
+import scoredice
+
+
+def all_rolls():
+    for count in range(1, 7):
+        for rolled in itertools.product(range(1, 7), repeat=count):
+            yield list(rolled)
+
+
+def test_table_matches_evaluate():
+    for rolled in all_rolls():
+        fast = scoredice.ScoreDice(rolled)
+        slow = scoredice.ScoreDice(rolled, use_table=False)
+        assert fast.total_points == slow.total_points, rolled
+        assert fast.dice_used == slow.dice_used, rolled
+        assert [(s.type, s.die, s.dice, s.points) for s in fast.scores] == \
+            [(s.type, s.die, s.dice, s.points) for s in slow.scores], rolled
+
+
+def test_table_size():
+    # 923 multisets of 1 to 6 dice, plus the empty roll
+    assert len(scoredice.build_score_table()) == 924
+
+
+def test_scores():
+    assert scoredice.ScoreDice([]).total_points == 0
+    assert scoredice.ScoreDice([2, 3, 4, 6]).total_points == 0
+    assert scoredice.ScoreDice([1, 5]).total_points == 150
+    assert scoredice.ScoreDice([1, 2, 3, 4, 5, 6]).total_points == 1500
+    assert scoredice.ScoreDice([2, 2, 3, 3, 4, 4]).total_points == 750
+    assert scoredice.ScoreDice([1, 1, 6, 6, 6, 6]).total_points == 1400
+    assert scoredice.ScoreDice([1, 1, 1, 5]).total_points == 1050
+    assert scoredice.ScoreDice([3, 1, 3, 3]).dice_used == [True, True, True, True]
+    assert scoredice.ScoreDice([3, 2, 3, 3]).dice_used == [True, False, True, True]
+
+
+def test_score_batch_matches_evaluate():
+    np = pytest.importorskip('numpy')
+    for count in range(1, 7):
+        rolls = np.array(list(itertools.product(range(1, 7), repeat=count)))
+        points, used = scoredice.score_batch(rolls)
+        for idx, rolled in enumerate(rolls.tolist()):
+            score = scoredice.ScoreDice(rolled, use_table=False)
+            assert points[idx] == score.total_points, rolled
+            assert used[idx].tolist() == score.dice_used, rolled
+
+
+def test_score_batch_empty_slots():
+    np = pytest.importorskip('numpy')
+    points, used = scoredice.score_batch(np.array([[1, 1, 6, 6, 6, 6], [5, 2, 0, 0, 0, 0]]))
+    assert points.tolist() == [1400, 50]
+    assert used.tolist() == [[True] * 6, [True, False, False, False, False, False]]
+
+
+def test_score_subsets_matches_score_dice():
+    rolled = [1, 5, 2, 2, 2, 6]
+    points, legal = scoredice.score_subsets(rolled)
+    assert len(points) == 64
+    assert not legal & 1
+    for mask in range(1, 64):
+        held = [rolled[idx] for idx in range(6) if mask & (1 << idx)]
+        score = scoredice.ScoreDice(held)
+        assert points[mask] == score.total_points
+        assert bool((legal >> mask) & 1) == (False not in score.dice_used)
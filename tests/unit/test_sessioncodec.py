@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+import app
+import gamestate
+import sessioncodec
+
+
+def played_game():
+    game = gamestate.GameState()
+    game.uniqID = 'abc'
+    game.player_id = 'p1'
+    game.gameMode = 'LONG'
+    game.turnBet = 500
+    game.won = 1250
+    game.tutorialStep = 3
+    game.hasDoubled = True
+    game.version = 7
+    for points in (350, 0, 1100):
+        turn = gamestate.TurnState()
+        turn.points = points
+        turn.unboostedPoints = points
+        turn.diceRolled = 2
+        turn.dice = [1, 5, 2, 2, 6, 3]
+        turn.rolled = True
+        turn.farkle = points == 0
+        game.turns.append(turn)
+    game.turn.dice = [4, 6]
+    game.turn.points = -500
+    game.turn.freshRolls = 2
+    game.turn.unfarkled = True
+    return game
+
+
+def test_round_trip():
+    game = played_game()
+    item = sessioncodec.encode_item(game)
+    assert set(item) == {'uniqID', 'player_id', 'version', 'state'}
+    # header, the current turn and three completed turns
+    assert len(item['state']) == 22 + 4 * 19
+    assert sessioncodec.decode_item(item).get_save_dict() == game.get_save_dict()
+
+
+def test_other_mode_and_version():
+    game = played_game()
+    game.gameMode = 'BLITZ'
+    assert sessioncodec.decode(sessioncodec.encode(game)).gameMode == 'BLITZ'
+    with pytest.raises(ValueError):
+        sessioncodec.decode(b'\x09' + sessioncodec.encode(game)[1:])
+    game.gameMode = '\u00e9' * 200
+    assert sessioncodec.decode(sessioncodec.encode(game)).gameMode == '\u00e9' * 127
+
+
+def test_start_checks_mode(store, call):
+    code, login = call('login', username='bob', password='secret', displayname='Bob')
+    code, game = call('start', player_id=login['player_id'], bet=500, mode='X' * 300)
+    assert code == 502
+    assert game['message'] == 'unknown mode'
+
+
+def test_version_1():
+    # version 1 had no state version in the header
+    data = sessioncodec.encode(played_game())
+    old = b'\x01' + data[1:18] + data[22:]
+    game = sessioncodec.decode(old)
+    assert game.version == 0
+    assert game.turns[2].points == 1100
+
+
+def test_map_sessions_are_migrated(store, call):
+    code, login = call('login', username='bob', password='secret', displayname='Bob')
+    code, game = call('start', player_id=login['player_id'], bet=500)
+    key = {'uniqID': game['uniqID']}
+    assert sessioncodec.is_encoded(store.get('sessions', key))
+
+    # a session saved as a map before the compact encoding
+    old = app.load_gamestate(store, game['uniqID']).get_save_dict()
+    del old['version']
+    store.put('sessions', json.loads(json.dumps(old, cls=app.GameEncoder)))
+    code, game = call('roll', session=game['uniqID'], player_id=login['player_id'])
+    assert code == 200
+    assert game['turn']['rolled']
+
+    item = store.get('sessions', key)
+    assert set(item) == {'uniqID', 'player_id', 'version', 'state'}
+    assert sessioncodec.decode_item(item).turn.dice == game['turn']['dice']
+    assert item['version'] == 1
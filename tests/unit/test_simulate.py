@@ -0,0 +1,18 @@
+import simulate
+
+
+def test_simulate_normal():
+    result = simulate.simulate("NORMAL", 200, workers=1, seed=7)
+    assert result.games == 200
+    assert result.turns == 200
+    assert result.amount_bet == 200 * 500
+    assert 0 < result.farkle_turns < result.turns
+    assert sum(result.scores.values()) == 200
+
+
+def test_simulate_long_is_repeatable():
+    first = simulate.simulate("LONG", 20, workers=1, seed=3, screws=1.0)
+    second = simulate.simulate("LONG", 20, workers=1, seed=3, screws=1.0)
+    assert first.turns == 200
+    assert first.amount_won == second.amount_won
+    assert first.scores == second.scores
@@ -0,0 +1,54 @@
+import pytest
+
+import dice
+import solver
+
+
+@pytest.fixture(scope='module')
+def small_solver():
+    return solver.TurnSolver(1.0, max_points=1000).solve()
+
+
+def test_roll_outcomes_sum_to_one():
+    for num_dice in range(1, 7):
+        outcomes = solver.roll_outcomes(num_dice, dice.face_probabilities(1.5))
+        assert sum(prob for _, prob in outcomes) == pytest.approx(1.0)
+    # a single die farkles on 2, 3, 4 and 6
+    farkle = dict(solver.roll_outcomes(1, dice.face_probabilities(1.0)))[()]
+    assert farkle == pytest.approx(4 / 6)
+
+
+def test_best_hold(small_solver):
+    # at the cap the turn always stops
+    hold, stop, value = small_solver.best_hold([1, 1, 1, 2, 3, 4], 900)
+    assert hold == [0, 1, 2] and stop and value == 1900
+    # with one die left and little banked, keep rolling
+    hold, stop, _ = small_solver.best_hold([5, 2], 0)
+    assert hold == [0] and not stop
+    assert small_solver.best_hold([2, 3], 500) == ([], True, 0.0)
+    hold, stop, value = small_solver.best_hold([2, 3], 500, solver.UNDO)
+    assert hold == [] and not stop and value >= 500
+    assert small_solver.stop_value(400, solver.DOUBLE) == 800
+
+
+def test_save_load(small_solver, tmp_path):
+    path = str(tmp_path / 'ev.bin')
+    small_solver.save(path)
+    loaded = solver.TurnSolver.load(path)
+    for num_dice in range(1, 7):
+        for boosts in range(8):
+            assert loaded.roll_value(num_dice, 250, boosts) == \
+                pytest.approx(small_solver.roll_value(num_dice, 250, boosts), rel=1e-6)
+
+
+def test_get_solver_checks_file(small_solver, tmp_path, monkeypatch):
+    path = str(tmp_path / 'ev.bin')
+    small_solver.save(path)
+    monkeypatch.setattr(solver, '_solvers', {})
+    assert solver.get_solver(1.0, 1000, path).screws == 1.0
+
+    # the file was solved for other dice, so it is solved again and replaced
+    resolved = solver.get_solver(1.5, 1000, path)
+    assert resolved.screws == 1.5
+    assert solver.TurnSolver.load(path).screws == 1.5
+    assert resolved.roll_value(6, 0) != pytest.approx(small_solver.roll_value(6, 0))
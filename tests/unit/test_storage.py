@@ -0,0 +1,284 @@
+import pytest
+
+import app
+import scoredice
+import sessioncodec
+import storage
+
+
+def test_update_paths(store):
+    key = {'player_id': 'p1'}
+    store.put('players', {'player_id': 'p1', 'farkle': {'amount_bet': 5}, 'password': b'\x00\xff'})
+    store.update('players', key, {'farkle.last_bonus': 'now'}, {'farkle.amount_bet': 10})
+    store.add('players', key, {'num_credits': -3})
+    item = store.get('players', key)
+    assert item['farkle'] == {'amount_bet': 15, 'last_bonus': 'now'}
+    assert item['num_credits'] == -3
+    assert item['password'] == b'\x00\xff'
+    store.delete('players', key)
+    assert store.get('players', key) is None
+
+
+def test_items_are_copies(store):
+    item = {'player_id': 'p1', 'farkle': {'games_played': 1}}
+    store.put('players', item)
+    item['farkle']['games_played'] = 2
+    store.get('players', {'player_id': 'p1'})['farkle']['games_played'] = 3
+    assert store.get('players', {'player_id': 'p1'})['farkle']['games_played'] == 1
+
+
+def test_failed_expect_writes_nothing(store):
+    store.put('games', {'gamename': 'farkle', 'jackpot': 100})
+    writes = [
+        {'table': 'games', 'key': {'gamename': 'farkle#1'}, 'add': {'jackpot': 5}},
+        {'table': 'games', 'key': {'gamename': 'farkle'}, 'set': {'jackpot': 0},
+         'expect': {'jackpot': (99,)}},
+    ]
+    with pytest.raises(storage.ConditionFailed) as error:
+        store.write(writes)
+    assert error.value.tables == {'games'}
+    assert store.get('games', {'gamename': 'farkle#1'}) is None
+    writes[1]['expect'] = {'jackpot': (100,)}
+    store.write(writes)
+    found = store.get_many({'games': app.jackpot_keys()})['games']
+    assert sorted(item['jackpot'] for item in found) == [0, 5]
+
+
+def test_usernames(store):
+    assert store.get_username('bob') is None
+    assert store.claim_username('bob', 'p1')
+    assert not store.claim_username('bob', 'p2')
+    assert store.get_username('bob') == 'p1'
+
+
+def test_username_taken_while_logging_in(store, call):
+    code, first = call('login', username='bob', password='secret', displayname='Bob')
+    get_username = store.get_username
+    reads = []
+
+    def stale(username, consistent=False):
+        # the claim of the first player has not reached this replica yet
+        reads.append(consistent)
+        return get_username(username) if consistent else None
+    store.get_username = stale
+    deleted = []
+    delete = store.delete
+
+    def recorded(table_name, key):
+        deleted.append(key)
+        delete(table_name, key)
+    store.delete = recorded
+    code, second = call('login', username='bob', password='secret', displayname='Bob')
+    assert code == 200
+    assert second['player_id'] == first['player_id']
+    assert reads == [False, True]
+    # the player made for the failed claim is deleted again
+    assert len(deleted) == 1
+    assert store.get('players', deleted[0]) is None
+
+
+def test_sqlite_keeps_items(tmp_path):
+    path = str(tmp_path / 'farkle.db')
+    db_conn = storage.SQLiteStorage(path)
+    db_conn.add('games', {'gamename': 'farkle'}, {'jackpot': 7})
+    db_conn.close()
+    assert storage.SQLiteStorage(path).get('games', {'gamename': 'farkle'})['jackpot'] == 7
+
+
+def test_dynamo_request():
+    operation, request = storage.dynamo_request({
+        'table': 'players',
+        'key': {'player_id': 'p1'},
+        'set': {'farkle.last_bonus': 'now'},
+        'add': {'farkle.amount_bet': 500, 'version': 1},
+        'expect': {'version': (None, 0)},
+    })
+    assert operation == 'Update'
+    assert request['UpdateExpression'] == \
+        'set #n1.#n2 = :v1, #n1.#n3 = if_not_exists(#n1.#n3, :zero) + :v3, ' \
+        '#n4 = if_not_exists(#n4, :zero) + :v4'
+    assert request['ConditionExpression'] == '(attribute_not_exists(#n4) OR #n4 = :v5)'
+    assert request['ExpressionAttributeNames'] == {
+        '#n1': 'farkle', '#n2': 'last_bonus', '#n3': 'amount_bet', '#n4': 'version'}
+    assert request['ExpressionAttributeValues'] == {
+        ':v1': 'now', ':zero': 0, ':v3': 500, ':v4': 1, ':v5': 0}
+
+
+def test_game_on_any_storage(store, call):
+    code, login = call('login', username='bob', password='secret', displayname='Bob')
+    assert code == 200
+    code, again = call('login', username='bob', password='secret', displayname='Bob')
+    assert again['player_id'] == login['player_id']
+    assert call('login', username='bob', password='wrong', displayname='Bob')[0] == 502
+
+    code, game = call('start', player_id=login['player_id'], bet=500)
+    assert code == 200
+    assert game['balance'] == login['balance'] - 500
+    code, game = call('roll', session=game['uniqID'], player_id=login['player_id'])
+    assert code == 200
+    assert game['turn']['rolled']
+
+    saved = store.get('players', {'player_id': login['player_id']})
+    assert saved['num_credits'] == login['balance'] - 500
+    assert saved['version'] == 1
+    jackpot = store.get_many({'games': app.jackpot_keys()})['games']
+    assert sum(item['jackpot'] for item in jackpot) == 50
+
+
+def test_stale_player_is_retried(store, call):
+    code, login = call('login', username='bob', password='secret', displayname='Bob')
+    code, game = call('start', player_id=login['player_id'], bet=500)
+    # another container changes the player behind the cached copy
+    store.add('players', {'player_id': login['player_id']}, {'num_credits': 1000, 'version': 1})
+    code, game = call('buyboosts', session=game['uniqID'], player_id=login['player_id'], gems=5)
+    assert code == 200
+    assert game['balance'] == login['balance'] - 500 + 1000
+    saved = store.get('players', {'player_id': login['player_id']})
+    assert saved['num_gems'] == login['numGems'] - 5
+    assert saved['num_credits'] == login['balance'] - 500 + 1000
+    assert saved['version'] == 3
+
+
+def test_conflicts_are_an_error_response(store, call):
+    code, login = call('login', username='bob', password='secret', displayname='Bob')
+    code, game = call('start', player_id=login['player_id'], bet=500)
+    writes = []
+
+    def conflict(request):
+        writes.append(request)
+        raise storage.ConditionFailed({'sessions'})
+    store.write = conflict
+    code, body = call('roll', session=game['uniqID'], player_id=login['player_id'])
+    assert code == 502
+    assert 'try again' in body['message']
+    assert len(writes) == app.PLAYER_WRITE_ATTEMPTS
+
+
+def test_interleaved_rolls(store, call):
+    code, login = call('login', username='bob', password='secret', displayname='Bob')
+    code, game = call('start', player_id=login['player_id'], bet=500, mode='TUTORIAL')
+    base = game['version']
+    stale = app.load_gamestate(store, game['uniqID'], login['player_id'])
+    loads = []
+
+    def load(consistent):
+        loads.append(consistent)
+        if len(loads) == 1:
+            return stale
+        return app.load_gamestate(store, game['uniqID'], login['player_id'], consistent)
+
+    def roll(game_state):
+        # hold the dice that score, as the client does
+        hold = None
+        if game_state.turn.rolled:
+            used = scoredice.ScoreDice(game_state.turn.dice).dice_used
+            hold = [idx for idx, is_used in enumerate(used) if is_used]
+        return game_state.roll(hold, False)
+
+    # another request rolls after stale was loaded from the same version
+    code, game = call('roll', session=game['uniqID'], player_id=login['player_id'])
+    assert game['version'] == base + 1
+    game_state = app.run_command(store, load, roll)
+    # the roll from the stale version is not saved, it runs again on the new one
+    assert loads == [False, True]
+    assert game_state.version == base + 2
+    assert game_state.turn.dice == [4, 2, 2, 2]
+    saved = sessioncodec.decode_item(store.get('sessions', {'uniqID': game['uniqID']}))
+    assert saved.version == base + 2
+    assert saved.turn.dice == [4, 2, 2, 2]
+
+
+class FakeBatchDynamo:
+    """answers BatchGetItem with the first player unprocessed the first time"""
+    def __init__(self):
+        self.requests = []
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        self.requests.append(RequestItems)
+        keys = RequestItems['players']['Keys']
+        if len(self.requests) == 1:
+            return {'Responses': {'players': [dict(key) for key in keys[1:]]},
+                    'UnprocessedKeys': {'players': {'Keys': keys[:1]}}}
+        return {'Responses': {'players': [dict(key) for key in keys]}}
+
+
+def test_dynamo_unprocessed_keys_are_retried(monkeypatch):
+    monkeypatch.setattr(storage.time, 'sleep', lambda seconds: None)
+    dynamo = FakeBatchDynamo()
+    db_conn = storage.DynamoStorage(dynamo)
+    found = db_conn.get_many({'players': [{'player_id': 'p1'}, {'player_id': 'p2'}]})
+    assert sorted(item['player_id'] for item in found['players']) == ['p1', 'p2']
+    assert len(dynamo.requests) == 2
+    assert dynamo.requests[1] == {'players': {'Keys': [{'player_id': 'p1'}]}}
+
+
+def test_load_in_one_round_trip(store, call):
+    code, login = call('login', username='bob', password='secret', displayname='Bob')
+    code, game = call('start', player_id=login['player_id'], bet=500)
+    calls = []
+    get_many = store.get_many
+
+    def counted(request_items, consistent=False):
+        calls.append(sorted(request_items))
+        return get_many(request_items, consistent)
+    store.get_many = counted
+    # with nothing cached, the session, player and jackpot are read together
+    app.set_storage(store)
+    game_state = app.load_gamestate(store, game['uniqID'], login['player_id'])
+    assert calls == [['games', 'players', 'sessions']]
+    assert game_state.balance == game['balance']
+
+
+class FakeClient:
+    def __init__(self):
+        self.requests = []
+
+    def transact_write_items(self, **kwargs):
+        self.requests.append(kwargs)
+        return {}
+
+
+class FakeTransactDynamo:
+    def __init__(self):
+        self.meta = type('Meta', (), {'client': FakeClient()})()
+
+
+def test_dynamo_transaction():
+    dynamo = FakeTransactDynamo()
+    storage.DynamoStorage(dynamo).write([
+        {'table': 'sessions', 'put': {'uniqID': 's1', 'player_id': 'p1', 'state': b'\x02'}},
+        {'table': 'players', 'key': {'player_id': 'p1'}, 'add': {'num_credits': -500},
+         'expect': {'version': (3,)}},
+    ])
+    items = dynamo.meta.client.requests[0]['TransactItems']
+    assert items[0] == {'Put': {'TableName': 'sessions', 'Item': {
+        'uniqID': {'S': 's1'}, 'player_id': {'S': 'p1'}, 'state': {'B': b'\x02'}}}}
+    update = items[1]['Update']
+    assert update['TableName'] == 'players'
+    assert update['Key'] == {'player_id': {'S': 'p1'}}
+    assert update['UpdateExpression'] == 'set #n1 = if_not_exists(#n1, :zero) + :v2'
+    assert update['ConditionExpression'] == '(#n2 = :v3)'
+    assert update['ExpressionAttributeNames'] == {'#n1': 'num_credits', '#n2': 'version'}
+    assert update['ExpressionAttributeValues'] == {
+        ':zero': {'N': '0'}, ':v2': {'N': '-500'}, ':v3': {'N': '3'}}
+
+
+def test_retry_reads_consistently(store, call):
+    code, login = call('login', username='bob', password='secret', displayname='Bob')
+    code, game = call('start', player_id=login['player_id'], bet=500)
+    key = {'player_id': login['player_id']}
+    stale = store.get('players', key)
+    store.add('players', key, {'num_credits': 1000, 'version': 1})
+    # this container still has the player from before the change
+    app._player_cache.put(login['player_id'], stale)
+    reads = []
+    get_many = store.get_many
+
+    def recorded(request_items, consistent=False):
+        reads.append((sorted(request_items), consistent))
+        return get_many(request_items, consistent)
+    store.get_many = recorded
+    code, game = call('buyboosts', session=game['uniqID'], player_id=login['player_id'], gems=5)
+    assert code == 200
+    # the first load used the cached player, the retry reads it again consistently
+    assert reads == [(['sessions'], False), (['players', 'sessions'], True)]
@@ -0,0 +1,72 @@
+"""One-off tool to fill the usernames table from the existing players, which
+   login_player needs before it can find players by username. Safe to run
+   more than once. Run it before deploying the usernames lookup:
+
+   python tools/backfill_usernames.py
+"""
+import argparse
+import os
+import sys
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'farkle'))
+
+# pylint: disable=wrong-import-position
+import storage
+
+
+def backfill(db_conn, dry_run=False):
+    """Add a usernames entry for every player with a username. Returns
+       (added, conflicts), where conflicts lists (username, player_id) of
+       players whose username already belongs to another player
+    """
+    players = storage.get_table(db_conn, 'players')
+    usernames = storage.get_table(db_conn, 'usernames')
+    added = 0
+    conflicts = []
+    scan_args = {
+        'ProjectionExpression': 'player_id, username',
+    }
+    while True:
+        response = players.scan(**scan_args)
+        for item in response['Items']:
+            username = item.get('username', '')
+            if username == '':
+                continue
+            if dry_run:
+                added += 1
+                continue
+            try:
+                usernames.put_item(
+                    Item={'username': username, 'player_id': item['player_id']},
+                    ConditionExpression="attribute_not_exists(username) OR player_id = :id",
+                    ExpressionAttributeValues={':id': item['player_id']}
+                )
+                added += 1
+            except ClientError as error:
+                if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                conflicts.append((username, item['player_id']))
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return added, conflicts
+
+
+def main():
+    """command line entry point
+    """
+    parser = argparse.ArgumentParser(description="fill the usernames table from players")
+    parser.add_argument('--dry-run', action='store_true', help="count without writing")
+    args = parser.parse_args()
+
+    added, conflicts = backfill(storage.get_dynamo(), args.dry_run)
+    print("%d usernames added" % added)
+    for username, player_id in conflicts:
+        # the players table never guaranteed unique usernames. These players
+        # cannot log in by username until they are resolved by hand
+        print("conflict: %s is already taken, player %s not added" % (username, player_id))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+"""Load test of the API. Virtual players log in and play NORMAL and LONG games
+   through app.shared_handler, with the API Gateway events the client would
+   send, while a pool of threads keeps many of them playing at once. Tables
+   are kept locally, in memory or in a SQLite file, so no AWS is needed.
+
+   python tools/loadtest.py --players 1000 --concurrency 1000 --storage memory
+"""
+import argparse
+import base64
+import collections
+import concurrent.futures
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'farkle'))
+
+# pylint: disable=wrong-import-position
+import app
+import scoredice
+import storage
+
+
+def api_event(command, data):
+    """build the API Gateway proxy event the client sends for a command
+    """
+    return {
+        'resource': '/farkle/{command}',
+        'path': '/farkle/' + command,
+        'httpMethod': 'POST',
+        'headers': {
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip, deflate, br',
+            'Content-Type': 'application/json',
+            'Host': 'localhost',
+            'User-Agent': 'farkle-loadtest',
+            'X-Forwarded-For': '127.0.0.1',
+        },
+        'queryStringParameters': None,
+        'pathParameters': {'command': command},
+        'stageVariables': None,
+        'requestContext': {
+            'resourcePath': '/farkle/{command}',
+            'httpMethod': 'POST',
+            'requestId': str(uuid.uuid4()),
+            'stage': 'Prod',
+            'identity': {'sourceIp': '127.0.0.1', 'userAgent': 'farkle-loadtest'},
+        },
+        'body': json.dumps(data),
+        'isBase64Encoded': False,
+    }
+
+
+class LoadStats:
+    """Latencies and errors of each command
+    """
+    def __init__(self):
+        # command -> list of seconds
+        self.latencies = collections.defaultdict(list)
+        # command -> responses that were not 200
+        self.errors = collections.Counter()
+        self.games = 0
+        self.seconds = 0.0
+        # the players' threads share one LoadStats
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def record(self, command, seconds, status):
+        """add one request
+        """
+        with self._lock:
+            self.latencies[command].append(seconds)
+            if status != 200:
+                self.errors[command] += 1
+
+    def add_game(self):
+        """count a finished game
+        """
+        with self._lock:
+            self.games += 1
+
+    def merge(self, other):
+        """add the requests of another run
+        """
+        for command, latencies in other.latencies.items():
+            self.latencies[command].extend(latencies)
+        self.errors.update(other.errors)
+        self.games += other.games
+        self.seconds = max(self.seconds, other.seconds)
+
+    def requests(self):
+        """number of requests made
+        """
+        return sum(len(latencies) for latencies in self.latencies.values())
+
+    def report(self):
+        """get the throughput and the latency percentiles of each command as text
+        """
+        lines = ["%d requests, %d games in %.2f s: %.0f requests per second" % (
+            self.requests(), self.games, self.seconds, self.requests() / max(self.seconds, 1e-9))]
+        lines.append("  %-10s %8s %7s %8s %8s %8s %8s" % (
+            'command', 'count', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'))
+        for command in sorted(self.latencies):
+            latencies = sorted(self.latencies[command])
+            lines.append("  %-10s %8d %7d %8.2f %8.2f %8.2f %8.2f" % (
+                command, len(latencies), self.errors[command],
+                percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000,
+                percentile(latencies, 99) * 1000, latencies[-1] * 1000))
+        return '\n'.join(lines)
+
+
+def percentile(values, pct):
+    """the nearest rank percentile of sorted values
+    """
+    if len(values) == 0:
+        return 0.0
+    rank = max(int(len(values) * pct / 100.0 + 0.999999) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class VirtualPlayer:
+    """One player going through the client flow: login, then start, roll and
+       hold until the turn is worth stop_at points, then stop. LONG games go
+       on turn after turn until the game is over.
+    """
+    def __init__(self, name, stats, rng, long_share=0.5, bet=500, stop_at=300):
+        self.name = name
+        self.stats = stats
+        self.rng = rng
+        self.long_share = long_share
+        self.bet = bet
+        self.stop_at = stop_at
+        self.player = None
+        self.session = ''
+
+    def send(self, command, **data):
+        """call the handler and record how long it took. Returns the response body
+        """
+        event = api_event(command, data)
+        start = time.perf_counter()
+        response = app.shared_handler(event, None)
+        self.stats.record(command, time.perf_counter() - start, response['statusCode'])
+        body = response['body']
+        if response.get('isBase64Encoded'):
+            # gzip or deflate, as API Gateway would send it
+            body = zlib.decompress(base64.b64decode(body), 47).decode('utf-8')
+        return json.loads(body)
+
+    def login(self):
+        """log in by username, creating the player the first time
+        """
+        self.player = self.send('login', username=self.name, password='loadtest',
+                                displayname=self.name)
+
+    def play_game(self):
+        """play one game, choosing its mode at random
+        """
+        mode = 'LONG' if self.rng.random() < self.long_share else 'NORMAL'
+        game = self.send('start', player_id=self.player['player_id'], session=self.session,
+                         bet=self.bet, mode=mode)
+        if 'uniqID' not in game:
+            return
+        self.session = game['uniqID']
+        while True:
+            game = self.play_turn()
+            if game is None or game.get('gameOver', True):
+                break
+            game = self.send('start', player_id=self.player['player_id'],
+                             session=self.session, bet=self.bet, mode=mode)
+        self.stats.add_game()
+
+    def play_turn(self):
+        """roll until the turn is worth stopping or it farkles, then stop
+        """
+        hold = None
+        while True:
+            game = self.send('roll', session=self.session, player_id=self.player['player_id'],
+                             hold=hold)
+            turn = game.get('turn')
+            if turn is None or not turn['rolled']:
+                return None
+            if turn['farkle']:
+                hold = None
+                break
+            score = scoredice.ScoreDice(turn['dice'])
+            hold = [idx for idx, used in enumerate(score.dice_used) if used]
+            left = len(turn['dice']) - len(hold)
+            if turn['points'] + score.total_points >= self.stop_at or 0 < left < 3:
+                break
+        return self.send('stop', session=self.session, player_id=self.player['player_id'],
+                         hold=hold)
+
+    def run(self, games):
+        """log in and play the games
+        """
+        self.login()
+        for _ in range(games):
+            self.play_game()
+
+
+def run_load(players=100, games=1, concurrency=32, long_share=0.5, storage_spec='memory',
+             seed=None, first_player=0):
+    """Play games for each virtual player, with concurrency of them playing at
+       once. Returns the LoadStats
+    """
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    app.set_storage(storage.open_storage(storage_spec))
+    stats = LoadStats()
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+        futures = []
+        for idx in range(first_player, first_player + players):
+            player_1 = VirtualPlayer('load%d' % idx, stats,
+                                     random.Random("%s:%d" % (seed, idx)), long_share)
+            futures.append(pool.submit(player_1.run, games))
+        for future in futures:
+            future.result()
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+def run_processes(processes, players=100, games=1, concurrency=32, long_share=0.5,
+                  storage_spec='memory', seed=None):
+    """Split the players over a process pool, each with its own threads. Each
+       process has its own memory storage, so use a SQLite file to share tables
+    """
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    sizes = [players // processes + (1 if idx < players % processes else 0) \
+             for idx in range(processes)]
+    stats = LoadStats()
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+        futures = []
+        first_player = 0
+        for size in sizes:
+            futures.append(pool.submit(run_load, size, games, max(concurrency // processes, 1),
+                                       long_share, storage_spec, seed, first_player))
+            first_player += size
+        for future in futures:
+            stats.merge(future.result())
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+def main():
+    """command line entry point
+    """
+    parser = argparse.ArgumentParser(description="load test the farkle API locally")
+    parser.add_argument('--players', type=int, default=1000)
+    parser.add_argument('--games', type=int, default=1, help="games each player plays")
+    parser.add_argument('--concurrency', type=int, default=64,
+                        help="players playing at the same time")
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--long-share', type=float, default=0.5,
+                        help="fraction of games played in LONG mode")
+    parser.add_argument('--storage', default='memory', help="memory or sqlite:<path>")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.processes > 1:
+        stats = run_processes(args.processes, args.players, args.games, args.concurrency,
+                              args.long_share, args.storage, args.seed)
+    else:
+        stats = run_load(args.players, args.games, args.concurrency, args.long_share,
+                         args.storage, args.seed)
+    print(stats.report())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+"""Monte Carlo simulation of farkle games, for measuring the payout of each
+   game mode. Games are played headlessly through GameState, the same way the
+   handlers in app.py drive it, and sharded across a process pool.
+
+   python tools/simulate.py --mode NORMAL --games 1000000 --workers 8
+"""
+import argparse
+import collections
+import concurrent.futures
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'farkle'))
+
+# pylint: disable=wrong-import-position
+import gamestate
+import scoredice
+
+
+class ThresholdStrategy:
+    """Hold every scoring die. Stop once the turn is worth stop_at points,
+       or when fewer than min_dice dice would be left to roll.
+    """
+    def __init__(self, stop_at=300, min_dice=3):
+        self.stop_at = stop_at
+        self.min_dice = min_dice
+
+    def __call__(self, game_state):
+        """decide what to do after a roll that was not a farkle.
+           returns (stop, hold) where hold is the list of dice indexes to hold
+        """
+        turn = game_state.turn
+        score = scoredice.ScoreDice(turn.dice)
+        hold = [idx for idx, used in enumerate(score.dice_used) if used]
+        left = turn.diceRolled - len(hold)
+        if left == 0:
+            # hot dice, all 6 get rolled again
+            left = 6
+        stop = turn.points + score.total_points >= self.stop_at or left < self.min_dice
+        return stop, hold
+
+
+class FixedScrewsGame(gamestate.GameState):
+    """GameState with the dice weighting fixed, instead of adapting to the player
+    """
+    __slots__ = ('screws',)
+
+    def __init__(self, screws):
+        super().__init__()
+        self.screws = screws
+
+    def get_screws(self):
+        return self.screws
+
+
+class SimResult:
+    """Totals from simulating a number of games in one mode
+    """
+    # width of the score distribution buckets
+    BUCKET = 500
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.games = 0
+        self.turns = 0
+        self.rolls = 0
+        # turns that ended in a farkle
+        self.farkle_turns = 0
+        # rolls that were a farkle
+        self.farkle_rolls = 0
+        self.jackpots = 0
+        self.jackpot_paid = 0
+        self.amount_bet = 0
+        self.amount_won = 0
+        # game score rounded down to BUCKET -> number of games
+        self.scores = collections.Counter()
+        self.seconds = 0.0
+
+    def merge(self, other):
+        """add the totals of another result for the same mode
+        """
+        for key in ('games', 'turns', 'rolls', 'farkle_turns', 'farkle_rolls', 'jackpots',
+                    'jackpot_paid', 'amount_bet', 'amount_won'):
+            setattr(self, key, getattr(self, key) + getattr(other, key))
+        self.scores.update(other.scores)
+        self.seconds = max(self.seconds, other.seconds)
+
+    def rtp(self, with_jackpot=True):
+        """return to player, as a fraction of the amount bet
+        """
+        if self.amount_bet == 0:
+            return 0.0
+        won = self.amount_won + (self.jackpot_paid if with_jackpot else 0)
+        return won / self.amount_bet
+
+    def report(self):
+        """get the results as readable text
+        """
+        lines = [
+            "mode %s: %d games, %d turns, %d rolls" % (self.mode, self.games, self.turns,
+                                                      self.rolls),
+            "  rtp %.4f (%.4f without jackpot)" % (self.rtp(), self.rtp(False)),
+            "  farkle rate %.4f per turn, %.4f per roll" % (
+                self.farkle_turns / max(self.turns, 1), self.farkle_rolls / max(self.rolls, 1)),
+            "  jackpot hit rate %.6f per turn (%d hits, %d paid)" % (
+                self.jackpots / max(self.turns, 1), self.jackpots, self.jackpot_paid),
+        ]
+        if self.seconds > 0:
+            lines.append("  %.0f turns per minute" % (self.turns * 60 / self.seconds))
+        lines.append("  score distribution:")
+        for score in sorted(self.scores):
+            lines.append("    %6d %.4f" % (score, self.scores[score] / max(self.games, 1)))
+        return '\n'.join(lines)
+
+
+def play_turn(game_state, strategy, result):
+    """play one turn until the strategy stops or the dice farkle
+    """
+    hold = None
+    while True:
+        game_state.roll(hold, False)
+        result.rolls += 1
+        if game_state.turn.farkle:
+            result.farkle_rolls += 1
+            result.farkle_turns += 1
+            hold = None
+            break
+        stop, hold = strategy(game_state)
+        if stop:
+            break
+
+    jackpot = game_state.jackpot
+    game_state.end_turn(hold)
+    result.turns += 1
+    if game_state.turn.points >= 10000:
+        result.jackpots += 1
+        result.jackpot_paid += jackpot
+
+
+def run_shard(mode, games, strategy, seed, bet=500, screws=None):
+    """play games with one player and an independent random stream
+    """
+    random.seed(seed)
+    if screws is None:
+        game_state = gamestate.GameState()
+    else:
+        game_state = FixedScrewsGame(screws)
+    game_state.balance = 10 ** 15
+    result = SimResult(mode)
+    start = time.perf_counter()
+    for _ in range(games):
+        game_state.gameMode = mode
+        game_state.start_turn(bet)
+        result.amount_bet += bet
+        while True:
+            play_turn(game_state, strategy, result)
+            # the saved adjustments are not needed between requests here
+            game_state.player_adjustments.clear()
+            game_state.game_adjust.clear()
+            if game_state.gameOver:
+                break
+            game_state.start_turn(bet)
+        result.games += 1
+        result.amount_won += game_state.wonGame
+        if mode == "LONG":
+            score = game_state.gameScore()
+        else:
+            score = game_state.turn.points
+        result.scores[score // SimResult.BUCKET * SimResult.BUCKET] += 1
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def simulate(mode="NORMAL", games=10000, strategy=None, workers=None, seed=None, bet=500,
+             screws=None, shards=None):
+    """Simulate games in the given mode, split into shards across a process pool.
+       Each shard gets its own random stream derived from seed. screws fixes the
+       dice weighting; None uses the weighting the game gives a new player.
+    """
+    if strategy is None:
+        strategy = ThresholdStrategy()
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    if shards is None:
+        shards = workers * 4
+    shards = max(1, min(shards, games))
+    sizes = [games // shards + (1 if idx < games % shards else 0) for idx in range(shards)]
+    seeds = ["%s:%d" % (seed, idx) for idx in range(shards)]
+
+    result = SimResult(mode)
+    start = time.perf_counter()
+    if workers == 1:
+        for size, shard_seed in zip(sizes, seeds):
+            result.merge(run_shard(mode, size, strategy, shard_seed, bet, screws))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(run_shard, mode, size, strategy, shard_seed, bet, screws)
+                       for size, shard_seed in zip(sizes, seeds)]
+            for future in futures:
+                result.merge(future.result())
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def main():
+    """command line entry point
+    """
+    parser = argparse.ArgumentParser(description="simulate farkle games")
+    parser.add_argument('--mode', action='append', choices=['NORMAL', 'LONG'],
+                        help="game mode, can be repeated. default is NORMAL and LONG")
+    parser.add_argument('--games', type=int, default=100000)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--bet', type=int, default=500)
+    parser.add_argument('--screws', type=float, default=None,
+                        help="fix the dice weighting instead of adapting to the player")
+    parser.add_argument('--stop-at', type=int, default=300)
+    parser.add_argument('--min-dice', type=int, default=3)
+    args = parser.parse_args()
+
+    strategy = ThresholdStrategy(args.stop_at, args.min_dice)
+    for mode in args.mode or ['NORMAL', 'LONG']:
+        result = simulate(mode, args.games, strategy, args.workers, args.seed, args.bet,
+                          args.screws)
+        print(result.report())
+
+
+if __name__ == '__main__':
+    main()
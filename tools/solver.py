@@ -0,0 +1,354 @@
+"""Exact expected values for playing a farkle turn, by dynamic programming over
+   (dice to roll, turn points, boosts available). The dice are weighted the way
+   TurnState.rand weights them for a given screws, and holds are scored with the
+   ScoreDice table.
+
+   Values are in turn points. In NORMAL mode a turn pays points * bet / 500, so
+   the return to player is the value of the first roll divided by 500. The
+   jackpot is not included.
+
+   python tools/solver.py --screws 1.0 --save ev_1.0.bin
+"""
+import argparse
+import array
+import itertools
+import math
+import os
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'farkle'))
+
+# pylint: disable=wrong-import-position
+import dice
+import gamestate
+import scoredice
+
+# boosts that can still be used, as bit flags
+EXTRA = 1
+UNDO = 2
+DOUBLE = 4
+ALL_BOOSTS = EXTRA | UNDO | DOUBLE
+
+# points always come in steps of 50
+STEP = 50
+
+_MAGIC = b'FKEV'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHdI')
+
+# probabilities below this are dropped when playing out LONG games
+_NEGLIGIBLE = 1e-13
+
+
+def roll_outcomes(num_dice, probabilities):
+    """Group every roll of num_dice dice by the holds it allows. Returns a list
+       of (options, probability) where options is a tuple of (points, dice left
+       to roll) for each legal hold. Farkles have no options.
+    """
+    table = scoredice.score_table()
+    groups = {}
+    for rolled in itertools.combinations_with_replacement(range(1, 7), num_dice):
+        counts = [rolled.count(face) for face in range(7)]
+        prob = math.factorial(num_dice)
+        for face in range(1, 7):
+            prob *= probabilities[face] ** counts[face] / math.factorial(counts[face])
+        if prob == 0.0:
+            continue
+
+        options = set()
+        for held in itertools.product(*[range(counts[face] + 1) for face in range(1, 7)]):
+            num_held = sum(held)
+            if num_held == 0:
+                continue
+            key = 0
+            faces = 0
+            for face in range(1, 7):
+                if held[face - 1]:
+                    key += scoredice.FACE_KEY[face] * held[face - 1]
+                    faces |= 1 << face
+            entry = table[key]
+            if faces & ~entry.used_faces == 0:
+                left = num_dice - num_held
+                options.add((entry.total_points // STEP, left if left > 0 else 6))
+        options = tuple(sorted(options))
+        groups[options] = groups.get(options, 0.0) + prob
+    return list(groups.items())
+
+
+class TurnSolver:
+    """Expected values of every decision in a turn, for one dice weighting
+    """
+    def __init__(self, screws=1.0, max_points=15000):
+        self.screws = screws
+        # at or above this many points the turn is always stopped
+        self.max_points = max_points
+        self._levels = max_points // STEP + 1
+        # expected points of rolling n dice, by [boosts][n][points / STEP]
+        self._roll = None
+        # expected points of an extra roll of 6 fair dice, by [boosts][points / STEP]
+        self._extra = None
+
+    def _index(self, boosts, num_dice, level):
+        return (boosts * 7 + num_dice) * self._levels + level
+
+    def solve(self):
+        """fill the expected value tables. Points only go up within a turn, so
+           levels are solved from the cap down
+        """
+        levels = self._levels
+        self._roll = array.array('d', [0.0]) * (8 * 7 * levels)
+        self._extra = array.array('d', [0.0]) * (8 * levels)
+        weighted = dice.face_probabilities(self.screws)
+        outcomes = [roll_outcomes(num_dice, weighted) for num_dice in range(7)]
+        # the extra roll calls TurnState.roll without screws, so the dice are fair
+        fair = roll_outcomes(6, dice.face_probabilities(1.0))
+
+        for level in range(levels - 1, -1, -1):
+            # removing a boost makes a smaller mask, so those are already solved
+            for boosts in range(8):
+                for num_dice in range(1, 7):
+                    self._roll[self._index(boosts, num_dice, level)] = \
+                        self._expect(outcomes[num_dice], num_dice, level, boosts)
+                self._extra[boosts * levels + level] = self._expect(fair, 6, level, boosts)
+        return self
+
+    def _expect(self, outcomes, num_dice, level, boosts):
+        total = 0.0
+        for options, prob in outcomes:
+            if options:
+                best = max(self._continue_value(left, level + points, boosts)
+                           for points, left in options)
+            elif boosts & UNDO:
+                # unfarkle restores the points and the same dice are rolled again
+                best = self._continue_value(num_dice, level, boosts & ~UNDO)
+            else:
+                best = 0.0
+            total += prob * best
+        return total
+
+    def _continue_value(self, num_dice, level, boosts):
+        """value of stopping or rolling again, whichever is better
+        """
+        stop = self._stop_value(level, boosts)
+        if level >= self._levels:
+            return stop
+        return max(stop, self._roll_value(num_dice, level, boosts)[1])
+
+    def _stop_value(self, level, boosts):
+        points = level * STEP
+        return 2.0 * points if boosts & DOUBLE else float(points)
+
+    def _roll_value(self, num_dice, level, boosts):
+        """(use extra roll, expected points) for rolling the next dice
+        """
+        value = self._roll[self._index(boosts, num_dice, level)]
+        if boosts & EXTRA and num_dice < 6:
+            extra = self._extra[(boosts & ~EXTRA) * self._levels + level]
+            if extra > value:
+                return True, extra
+        return False, value
+
+    def _level(self, points):
+        return min(points // STEP, self._levels)
+
+    def roll_value(self, num_dice, points, boosts=0):
+        """expected points of rolling num_dice dice with points already held,
+           using the extra roll if that is better
+        """
+        return self._roll_value(num_dice, min(self._level(points), self._levels - 1), boosts)[1]
+
+    def use_extra(self, num_dice, points, boosts=0):
+        """True if the extra roll powerup should be used for the next roll
+        """
+        return self._roll_value(num_dice, min(self._level(points), self._levels - 1), boosts)[0]
+
+    def stop_value(self, points, boosts=0):
+        """points for ending the turn now, doubled if the 2X boost is available
+        """
+        return self._stop_value(self._level(points), boosts)
+
+    def best_hold(self, rolled, points, boosts=0):
+        """Choose what to do after rolling the dice in rolled with points already
+           held this turn. Returns (hold, stop, value) where hold is the list of
+           dice indexes to hold. A farkle returns an empty hold, and stop is False
+           only if the farkle should be undone.
+        """
+        hold_points, legal = scoredice.score_subsets(rolled)
+        level = self._level(points)
+        best = None
+        for mask in range(1, len(hold_points)):
+            if not (legal >> mask) & 1:
+                continue
+            left = len(rolled) - bin(mask).count('1')
+            left = left if left > 0 else 6
+            next_level = level + hold_points[mask] // STEP
+            stop = self._stop_value(next_level, boosts)
+            value, stopping = stop, True
+            if next_level < self._levels:
+                roll = self._roll_value(left, next_level, boosts)[1]
+                if roll > stop:
+                    value, stopping = roll, False
+            if best is None or value > best[2]:
+                best = ([idx for idx in range(len(rolled)) if mask & (1 << idx)], stopping, value)
+
+        if best is None:
+            if boosts & UNDO:
+                return [], False, self._continue_value(len(rolled), level, boosts & ~UNDO)
+            return [], True, 0.0
+        return best
+
+    def normal_rtp(self, boosts=0):
+        """return to player of a NORMAL game, not counting the jackpot
+        """
+        return self.roll_value(6, 0, boosts) / 500
+
+    def turn_distribution(self):
+        """probability of each final turn points when playing every turn
+           optimally without boosts. Returns {points: probability}, where a
+           farkle is recorded as None
+        """
+        weighted = dice.face_probabilities(self.screws)
+        outcomes = [roll_outcomes(num_dice, weighted) for num_dice in range(7)]
+        final = {}
+        # (dice to roll, level) -> probability, in increasing level order
+        pending = {(6, 0): 1.0}
+        for level in range(self._levels):
+            for num_dice in range(1, 7):
+                mass = pending.pop((num_dice, level), 0.0)
+                if mass == 0.0:
+                    continue
+                for options, prob in outcomes[num_dice]:
+                    if not options:
+                        final[None] = final.get(None, 0.0) + mass * prob
+                        continue
+                    best = max(options, key=lambda opt: self._continue_value(
+                        opt[1], level + opt[0], 0))
+                    next_level = level + best[0]
+                    if next_level >= self._levels or \
+                            self._stop_value(next_level, 0) >= \
+                            self._roll_value(best[1], next_level, 0)[1]:
+                        points = next_level * STEP
+                        final[points] = final.get(points, 0.0) + mass * prob
+                    else:
+                        key = (best[1], next_level)
+                        pending[key] = pending.get(key, 0.0) + mass * prob
+        return final
+
+    def long_rtp(self, turns=10):
+        """Return to player of a LONG game when every turn is played to maximize
+           its own points, which is a lower bound on optimal LONG play. Includes
+           the -500 penalty for three farkles in a row.
+        """
+        # outcomes this unlikely do not change the result, but make the state space much bigger
+        turn_points = [(points, prob) for points, prob in self.turn_distribution().items()
+                       if prob > _NEGLIGIBLE]
+        game = gamestate.GameState()
+
+        def goals_reached(total, goal):
+            game._goal = goal
+            while total >= game.goalAmount():
+                game._goal += 1
+            return game._goal
+
+        # (game score, goals reached, farkles in a row) -> probability
+        states = {(0, 0, 0): 1.0}
+        for _ in range(turns):
+            next_states = {}
+            for (total, goal, farkles), mass in states.items():
+                for points, prob in turn_points:
+                    if points is None:
+                        if farkles == 2:
+                            key = (total - 500, goal, 0)
+                        else:
+                            key = (total, goal, farkles + 1)
+                    else:
+                        key = (total + points, goals_reached(total + points, goal), 0)
+                    next_states[key] = next_states.get(key, 0.0) + mass * prob
+            states = {key: mass for key, mass in next_states.items() if mass > _NEGLIGIBLE}
+        return sum(goal * mass for (_, goal, _), mass in states.items())
+
+    def save(self, path):
+        """write the tables as a compact binary file of float32 values
+        """
+        with open(path, 'wb') as out:
+            out.write(_HEADER.pack(_MAGIC, _VERSION, self.screws, self.max_points))
+            array.array('f', self._roll).tofile(out)
+            array.array('f', self._extra).tofile(out)
+
+    @classmethod
+    def load(cls, path):
+        """read tables written by save
+        """
+        with open(path, 'rb') as infile:
+            magic, version, screws, max_points = _HEADER.unpack(infile.read(_HEADER.size))
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError("not an expected value table: %s" % path)
+            solver = cls(screws, max_points)
+            values = array.array('f')
+            values.fromfile(infile, 8 * 7 * solver._levels)
+            solver._roll = array.array('d', values)
+            values = array.array('f')
+            values.fromfile(infile, 8 * solver._levels)
+            solver._extra = array.array('d', values)
+        return solver
+
+
+# solved tables by (screws, max_points), so each is only solved once per process
+_solvers = {}
+
+
+def get_solver(screws=1.0, max_points=15000, path=None):
+    """get the solver for the dice weighting, loading it from path if that
+       file exists and was solved for the same weighting, otherwise solving it
+       and saving it there
+    """
+    key = (screws, max_points)
+    if key not in _solvers:
+        solver = None
+        if path is not None:
+            try:
+                solver = TurnSolver.load(path)
+            except FileNotFoundError:
+                pass
+        if solver is not None and (solver.max_points != max_points or \
+                                   not math.isclose(solver.screws, screws, rel_tol=1e-6)):
+            # the file is for another weighting, so it is solved again
+            solver = None
+        if solver is None:
+            solver = TurnSolver(screws, max_points).solve()
+            if path is not None:
+                solver.save(path)
+        _solvers[key] = solver
+    return _solvers[key]
+
+
+class SolverStrategy:
+    """simulate.py strategy that plays each turn optimally without boosts
+    """
+    def __init__(self, solver):
+        self.solver = solver
+
+    def __call__(self, game_state):
+        hold, stop, _ = self.solver.best_hold(game_state.turn.dice, game_state.turn.points)
+        return stop, hold
+
+
+def main():
+    """command line entry point
+    """
+    parser = argparse.ArgumentParser(description="solve farkle turn expected values")
+    parser.add_argument('--screws', type=float, default=1.0)
+    parser.add_argument('--max-points', type=int, default=15000)
+    parser.add_argument('--save', default=None, help="file to load or save the tables")
+    args = parser.parse_args()
+
+    solver = get_solver(args.screws, args.max_points, args.save)
+    print("screws %.3f" % solver.screws)
+    for boosts in range(8):
+        print("  NORMAL rtp with boosts %d: %.4f" % (boosts, solver.normal_rtp(boosts)))
+    print("  LONG rtp without boosts: %.4f" % solver.long_rtp())
+
+
+if __name__ == '__main__':
+    main()